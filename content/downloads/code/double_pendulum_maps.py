@@ -0,0 +1,197 @@
+"""
+Chaos maps of the double pendulum
+
+Computes, for a grid of initial angles (theta1, theta2) released from
+rest, either the time until one of the arms first flips over, or the
+largest Lyapunov exponent.  The grid is cut into square tiles which are
+computed by a pool of worker processes, using the batched equations of
+motion of double_pendulum.py.  Each finished tile is written straight
+into a memory-mapped .npy result, and recorded in a second .npy file of
+finished tiles, so that an interrupted run picks up where it stopped:
+
+    python double_pendulum_maps.py flip.npy --size 4096 --quantity flip
+    python double_pendulum_maps.py flip.npy --plot
+"""
+from argparse import ArgumentParser
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from double_pendulum import derivs, rk4
+
+
+def initial_states(size, rows, cols):
+    """the states at rest on the given rows (theta2) and columns (theta1)"""
+    angle = -np.pi + 2 * np.pi * (np.arange(size) + 0.5) / size
+    theta1, theta2 = np.meshgrid(angle[cols], angle[rows])
+    state = np.zeros(theta1.shape + (4,))
+    state[..., 0] = theta1
+    state[..., 2] = theta2
+    return state.reshape(-1, 4)
+
+
+def flip_time(state, params, dt, t_max):
+    """
+    time until either arm first flips over, i.e. until either angle
+    leaves [-pi, pi], or NaN if it does not within t_max.  States whose
+    energy is too low to ever flip are not integrated.
+    """
+    L1, L2, M1, M2, G = params
+    result = np.nan * np.ones(len(state))
+
+    # released from rest, an arm can only flip if the energy exceeds its
+    # lowest value with an arm upright: either the first hanging down and
+    # the second upright, or the first upright and the second hanging
+    # down, whichever is lower
+    U = (-(M1 + M2) * L1 * np.cos(state[:, 0])
+         - M2 * L2 * np.cos(state[:, 2]))
+    active = np.where(U > -abs((M1 + M2) * L1 - M2 * L2))[0]
+    state = state[active]
+
+    t = 0
+    while len(active) and t < t_max:
+        state = rk4(derivs, state, t, dt, 1, params)
+        t += dt
+        flipped = (abs(state[:, 0]) > np.pi) | (abs(state[:, 2]) > np.pi)
+        result[active[flipped]] = t
+        active = active[~flipped]
+        state = state[~flipped]
+    return result
+
+
+def lyapunov(state, params, dt, t_max, d0=1E-8, renormalize=10):
+    """
+    largest Lyapunov exponent over t_max, from the growth of a small
+    perturbation of theta1, renormalized every few steps
+    """
+    other = state.copy()
+    other[:, 0] += d0
+    log_growth = np.zeros(len(state))
+
+    Nsteps = int(t_max / dt)
+    for i in range(0, Nsteps, renormalize):
+        n = min(renormalize, Nsteps - i)
+        state = rk4(derivs, state, i * dt, dt, n, params)
+        other = rk4(derivs, other, i * dt, dt, n, params)
+        d = np.sqrt(((other - state) ** 2).sum(1))
+        log_growth += np.log(d / d0)
+        other = state + (other - state) * (d0 / d)[:, None]
+    return log_growth / (Nsteps * dt)
+
+
+QUANTITIES = {'flip': flip_time,
+              'lyapunov': lyapunov}
+
+
+def compute_tile(args):
+    """compute one tile and write it into the result file"""
+    filename, quantity, i, j, tile, size, params, dt, t_max = args
+    rows = slice(i * tile, min((i + 1) * tile, size))
+    cols = slice(j * tile, min((j + 1) * tile, size))
+    state = initial_states(size, rows, cols)
+    values = QUANTITIES[quantity](state, params, dt, t_max)
+
+    result = np.load(filename, mmap_mode='r+')
+    result[rows, cols] = values.reshape(result[rows, cols].shape)
+    result.flush()
+    return i, j
+
+
+def done_filename(filename):
+    return os.path.splitext(filename)[0] + '_done.npy'
+
+
+def open_map(filename, settings):
+    """
+    return the memory-mapped result and finished-tile arrays, creating
+    them unless a run with the same settings already started them
+    """
+    tiles = -(-settings['size'] // settings['tile'])
+    info = os.path.splitext(filename)[0] + '.json'
+    if os.path.exists(filename):
+        with open(info) as f:
+            if json.load(f) != settings:
+                raise ValueError("%s was started with other settings: %s"
+                                 % (filename, info))
+        return (np.load(filename, mmap_mode='r+'),
+                np.load(done_filename(filename), mmap_mode='r+'))
+
+    with open(info, 'w') as f:
+        json.dump(settings, f)
+    done = np.lib.format.open_memmap(done_filename(filename), mode='w+',
+                                     dtype=np.uint8, shape=(tiles, tiles))
+    result = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float32,
+                                       shape=(settings['size'],) * 2)
+    result[:] = np.nan
+    result.flush()
+    return result, done
+
+
+def compute_map(filename, settings, workers=None):
+    """compute the tiles of the map which are not finished yet"""
+    result, done = open_map(filename, settings)
+    params = tuple(settings[key] for key in ['L1', 'L2', 'M1', 'M2', 'G'])
+    tasks = [(filename, settings['quantity'], i, j, settings['tile'],
+              settings['size'], params, settings['dt'], settings['t_max'])
+             for i in range(done.shape[0]) for j in range(done.shape[1])
+             if not done[i, j]]
+    print("%i of %i tiles left" % (len(tasks), done.size))
+
+    pool = multiprocessing.Pool(workers)
+    for n, (i, j) in enumerate(pool.imap_unordered(compute_tile, tasks)):
+        done[i, j] = 1
+        done.flush()
+        print("tile (%i, %i) done, %i left" % (i, j, len(tasks) - n - 1))
+    pool.close()
+    pool.join()
+
+
+def plot_map(filename):
+    import matplotlib.pyplot as plt
+    with open(os.path.splitext(filename)[0] + '.json') as f:
+        settings = json.load(f)
+    result = np.load(filename, mmap_mode='r')
+
+    # plot at most about 1000 x 1000 points of a large map
+    skip = max(1, result.shape[0] // 1000)
+    fig, ax = plt.subplots()
+    im = ax.imshow(result[::skip, ::skip], origin='lower',
+                   extent=[-180, 180, -180, 180],
+                   norm=(plt.matplotlib.colors.LogNorm()
+                         if settings['quantity'] == 'flip' else None))
+    fig.colorbar(im, ax=ax, label=('time to first flip (s)'
+                                   if settings['quantity'] == 'flip'
+                                   else 'Lyapunov exponent (1/s)'))
+    ax.set_xlabel('theta1 (degrees)')
+    ax.set_ylabel('theta2 (degrees)')
+    plt.show()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('filename', help="the .npy file of the map")
+    parser.add_argument('--quantity', choices=sorted(QUANTITIES),
+                        default='flip')
+    parser.add_argument('--size', type=int, default=1024,
+                        help="number of grid points along each angle")
+    parser.add_argument('--tile', type=int, default=128,
+                        help="number of grid points along each tile")
+    parser.add_argument('--dt', type=float, default=0.01,
+                        help="time step of the RK4 integration (s)")
+    parser.add_argument('--t-max', type=float, default=100.,
+                        help="time to integrate for (s)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of processes (default: all cores)")
+    parser.add_argument('--plot', action='store_true',
+                        help="plot the map as computed so far and exit")
+    args = parser.parse_args()
+
+    if args.plot:
+        plot_map(args.filename)
+    else:
+        settings = dict(quantity=args.quantity, size=args.size,
+                        tile=args.tile, dt=args.dt, t_max=args.t_max,
+                        L1=1.0, L2=1.0, M1=1.0, M2=1.0, G=9.8)
+        compute_map(args.filename, settings, args.workers)
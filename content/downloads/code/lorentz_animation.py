@@ -9,74 +9,210 @@ from matplotlib import animation
 N_trajectories = 20
 
 
-def lorentz_deriv((x, y, z), t0, sigma=10., beta=8./3, rho=28.0):
-    """Compute the time-derivative of a Lorentz system."""
-    return [sigma * (y - x), x * (rho - z) - y, x * y - beta * z]
-
-
-# Choose random starting points, uniformly distributed from -15 to 15
-np.random.seed(1)
-x0 = -15 + 30 * np.random.random((N_trajectories, 3))
-
-# Solve for the trajectories
-t = np.linspace(0, 4, 1000)
-x_t = np.asarray([integrate.odeint(lorentz_deriv, x0i, t)
-                  for x0i in x0])
-
-# Set up figure & 3D axis for animation
-fig = plt.figure()
-ax = fig.add_axes([0, 0, 1, 1], projection='3d')
-ax.axis('off')
-
-# choose a different color for each trajectory
-colors = plt.cm.jet(np.linspace(0, 1, N_trajectories))
-
-# set up lines and points
-lines = sum([ax.plot([], [], [], '-', c=c)
-             for c in colors], [])
-pts = sum([ax.plot([], [], [], 'o', c=c)
-           for c in colors], [])
-
-# prepare the axes limits
-ax.set_xlim((-25, 25))
-ax.set_ylim((-35, 35))
-ax.set_zlim((5, 55))
-
-# set point-of-view: specified by (altitude degrees, azimuth degrees)
-ax.view_init(30, 0)
-
-# initialization function: plot the background of each frame
-def init():
-    for line, pt in zip(lines, pts):
-        line.set_data([], [])
-        line.set_3d_properties([])
-
-        pt.set_data([], [])
-        pt.set_3d_properties([])
-    return lines + pts
-
-# animation function.  This will be called sequentially with the frame number
-def animate(i):
-    # we'll step two time-steps per frame.  This leads to nice results.
-    i = (2 * i) % x_t.shape[1]
-
-    for line, pt, xi in zip(lines, pts, x_t):
-        x, y, z = xi[:i].T
-        line.set_data(x, y)
-        line.set_3d_properties(z)
-
-        pt.set_data(x[-1:], y[-1:])
-        pt.set_3d_properties(z[-1:])
-
-    ax.view_init(30, 0.3 * i)
-    fig.canvas.draw()
-    return lines + pts
-
-# instantiate the animator.
-anim = animation.FuncAnimation(fig, animate, init_func=init,
-                               frames=500, interval=30, blit=True)
-
-# Save as mp4. This requires mplayer or ffmpeg to be installed
-#anim.save('lorentz_attractor.mp4', fps=15, extra_args=['-vcodec', 'libx264'])
-
-plt.show()
+def lorentz_deriv(state, t0, sigma=10., beta=8./3, rho=28.0):
+    """
+    Compute the time-derivative of a Lorentz system.  state is (x, y, z),
+    or an [N x 3] array of such points, which are all evaluated at once.
+    """
+    state = np.asarray(state)
+    x = state[..., 0]
+    y = state[..., 1]
+    z = state[..., 2]
+
+    dstate = np.empty_like(state, dtype=float)
+    dstate[..., 0] = sigma * (y - x)
+    dstate[..., 1] = x * (rho - z) - y
+    dstate[..., 2] = x * y - beta * z
+    return dstate
+
+
+def integrate_chunks(f, x0, t, chunk_size=100, args=(), rtol=1E-8,
+                     atol=1E-8):
+    """
+    Integrate dx/dt = f(x, t, *args) from x0 at t[0], and yield the
+    solution at the times t as a sequence of blocks (t_chunk, x_chunk) of
+    chunk_size times each, as soon as each block is done.  Only one block
+    is held in memory at a time.
+
+    f has the signature of the functions passed to odeint, such as
+    lorentz_deriv or DoublePendulum.dstate_dt, and x0 may be a single
+    state or an array of states, which are integrated together as one
+    system with a shared step size.  The time axis of the blocks is the
+    last but one: a block is [k x 3] for a single point of the Lorentz
+    system, and [N x k x 3] for N points.
+
+    A single DOP853 solver runs across all the blocks, and the output
+    times are interpolated from its dense output.
+    """
+    x0 = np.asarray(x0, dtype=float)
+    shape = x0.shape
+    t = np.asarray(t, dtype=float)
+
+    def rhs(t, y):
+        return np.ravel(f(y.reshape(shape), t, *args))
+
+    solver = integrate.DOP853(rhs, t[0], x0.ravel(), t[-1],
+                              rtol=rtol, atol=atol)
+    interpolant = None
+
+    for start in range(0, len(t), chunk_size):
+        t_chunk = t[start:start + chunk_size]
+        y = np.empty((len(t_chunk), x0.size))
+        for k, tk in enumerate(t_chunk):
+            while solver.t < tk:
+                message = solver.step()
+                if solver.status == 'failed':
+                    raise RuntimeError(message)
+                interpolant = None
+            if tk == solver.t:
+                y[k] = solver.y
+            else:
+                if interpolant is None:
+                    interpolant = solver.dense_output()
+                y[k] = interpolant(tk)
+        yield t_chunk, np.moveaxis(y.reshape((len(t_chunk),) + shape), 0, -2)
+
+
+def integrate_bundle(x0, t, deriv=lorentz_deriv, args=(), rtol=1E-8,
+                     atol=1E-8):
+    """
+    Integrate the trajectories starting at each of the [N x 3] points x0
+    together, as one system of 3N equations, with a single solver.
+    Returns an [N x len(t) x 3] array of the points at the times t.
+
+    The step size is shared by the whole bundle, and is controlled by the
+    error norm over all the trajectories.  See integrate_chunks() to
+    process long integrations block by block instead.
+    """
+    t_chunk, x_t = next(integrate_chunks(deriv, x0, t, len(t), args,
+                                         rtol, atol))
+    return x_t
+
+
+class TrailRenderer(object):
+    """
+    Draw the trails of N points moving in 3D.
+
+    The trail of point i is drawn on the line lines[i] and its head on
+    the marker points[i].  The trails are kept in preallocated buffers:
+    push() copies in only the new points, and draw() hands the artists
+    views of the buffers.
+
+    With tail=None the whole history is kept, starting with room for
+    capacity points per trail.  With tail=L only the last L points are
+    kept in a ring buffer, so that the cost of a frame does not grow with
+    the number of frames.  Each point is written twice in a buffer of
+    size 2L, so that the last L points are always a contiguous view.
+    """
+    def __init__(self, lines, points, tail=None, capacity=1000):
+        self.lines = lines
+        self.points = points
+        self.tail = tail
+        size = 2 * tail if tail else capacity
+        self.buffer = np.empty((len(lines), 3, size))
+        self.n = 0
+
+    def reset(self):
+        """forget all points pushed so far"""
+        self.n = 0
+
+    def push(self, new_points):
+        """append an [N x k x 3] block of the next k points of each trail"""
+        block = np.asarray(new_points).transpose(0, 2, 1)
+        k = block.shape[2]
+        if self.tail:
+            index = (self.n + np.arange(k)) % self.tail
+            self.buffer[:, :, index] = block
+            self.buffer[:, :, index + self.tail] = block
+        else:
+            if self.n + k > self.buffer.shape[2]:
+                size = max(2 * self.buffer.shape[2], self.n + k)
+                buffer = np.empty(self.buffer.shape[:2] + (size,))
+                buffer[:, :, :self.n] = self.buffer[:, :, :self.n]
+                self.buffer = buffer
+            self.buffer[:, :, self.n:self.n + k] = block
+        self.n += k
+
+    def draw(self):
+        """update the artists, and return them"""
+        if self.tail:
+            length = min(self.n, self.tail)
+            start = (self.n - length) % self.tail
+        else:
+            length = self.n
+            start = 0
+        trails = self.buffer[:, :, start:start + length]
+
+        for line, pt, (x, y, z) in zip(self.lines, self.points, trails):
+            line.set_data(x, y)
+            line.set_3d_properties(z)
+
+            pt.set_data(x[-1:], y[-1:])
+            pt.set_3d_properties(z[-1:])
+        return self.lines + self.points
+
+
+if __name__ == '__main__':
+    # Choose random starting points, uniformly distributed from -15 to 15
+    np.random.seed(1)
+    x0 = -15 + 30 * np.random.random((N_trajectories, 3))
+
+    # the trajectories are integrated as the animation runs, two time
+    # steps at a time
+    t = np.linspace(0, 4, 1000)
+
+    # Set up figure & 3D axis for animation
+    fig = plt.figure()
+    ax = fig.add_axes([0, 0, 1, 1], projection='3d')
+    ax.axis('off')
+
+    # choose a different color for each trajectory
+    colors = plt.cm.jet(np.linspace(0, 1, N_trajectories))
+
+    # set up lines and points
+    lines = sum([ax.plot([], [], [], '-', c=c)
+                 for c in colors], [])
+    pts = sum([ax.plot([], [], [], 'o', c=c)
+               for c in colors], [])
+
+    # prepare the axes limits
+    ax.set_xlim((-25, 25))
+    ax.set_ylim((-35, 35))
+    ax.set_zlim((5, 55))
+
+    # set point-of-view: specified by (altitude degrees, azimuth degrees)
+    ax.view_init(30, 0)
+
+    # the trails of the points are drawn from preallocated buffers.  Pass
+    # tail=100, say, to draw only the last 100 points of each trajectory.
+    trails = TrailRenderer(lines, pts, capacity=len(t))
+
+    # initialization function: plot the background of each frame
+    def init():
+        trails.reset()
+        return trails.draw()
+
+    # animation function.  This will be called sequentially with the
+    # frame number
+    def animate(i):
+        global chunks
+        if i == 0:
+            trails.reset()
+            chunks = integrate_chunks(lorentz_deriv, x0, t, chunk_size=2)
+
+        # we'll step two time-steps per frame.  This leads to nice results.
+        t_i, x_i = next(chunks)
+        trails.push(x_i)
+
+        ax.view_init(30, 0.6 * i)
+        return trails.draw()
+
+    # instantiate the animator.  The view turns in every frame, so the
+    # whole figure is redrawn anyway and blitting would not help.
+    anim = animation.FuncAnimation(fig, animate, init_func=init,
+                                   frames=500, interval=30, blit=False)
+
+    # Save as mp4. This requires mplayer or ffmpeg to be installed
+    #anim.save('lorentz_attractor.mp4', fps=15, extra_args=['-vcodec', 'libx264'])
+
+    plt.show()
@@ -0,0 +1,122 @@
+"""Load the tiles of an NES ROM as an atlas of 2-bit color indices
+
+Each 16-byte tile of the ROM holds two 8x8 bitplanes; the color index of
+a pixel is the bit of the first plane plus twice the bit of the second.
+load_atlas decodes all tiles once into their color indices, packed four
+pixels to a byte: 16 bytes per tile, 1/8 of the memory of one byte per
+bit.  It saves them in a user cache directory under a name keyed by the
+SHA-1 of the ROM, and on later runs memory-maps the saved atlas instead
+of decoding again.  Indexing the returned TileAtlas unpacks the tiles
+gathered into uint8 arrays of shape (..., 8, 8), with one lookup.
+
+Tiles are counted from the start of the file (header and program data
+included), so that tile offsets into the file stay the same.
+
+By Jake Vanderplas, 2013 <http://jakevdp.github.com>
+License: GPL.
+Feel free to use and distribute, but keep this attribution intact.
+"""
+import hashlib
+import os
+import zipfile
+import numpy as np
+
+
+def read_rom(filename):
+    """return the bytes of a ROM, either raw or as the first file of a zip"""
+    if zipfile.is_zipfile(filename):
+        zp = zipfile.ZipFile(filename)
+        return zp.read(zp.filelist[0])
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def decode_tiles(rom):
+    """decode the bytes of a ROM into a (T, 8, 8) array of color indices"""
+    data = np.frombuffer(rom, dtype=np.uint8)
+    data = data[:len(data) // 16 * 16].reshape((-1, 2, 8, 1))
+    bits = np.unpackbits(data, axis=3)
+    return bits[:, 0] + 2 * bits[:, 1]
+
+
+def pack_tiles(tiles):
+    """pack a (T, 8, 8) array of color indices into (T, 8, 2) bytes"""
+    p = tiles.reshape(tiles.shape[:-1] + (2, 4)).astype(np.uint8)
+    return (p[..., 0] << 6) | (p[..., 1] << 4) | (p[..., 2] << 2) | p[..., 3]
+
+
+# the four color indices packed into each byte value
+_UNPACK = (np.arange(256, dtype=np.uint8)[:, None]
+           >> np.array([6, 4, 2, 0], dtype=np.uint8)) & 3
+
+
+class TileAtlas(object):
+    """
+    The color indices of the T tiles of a ROM, packed four pixels to a
+    byte.  atlas[index] unpacks the tiles selected by any numpy index of
+    the first axis into a uint8 array of shape (..., 8, 8), as if the
+    atlas were a (T, 8, 8) array.
+    """
+    def __init__(self, packed):
+        self.packed = packed
+        self.shape = (len(packed), 8, 8)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        rows = _UNPACK[self.packed[index]]
+        return rows.reshape(rows.shape[:-2] + (8,))
+
+
+def default_cache_dir():
+    """$XDG_CACHE_HOME/chr_atlas, or ~/.cache/chr_atlas"""
+    cache_home = (os.environ.get('XDG_CACHE_HOME')
+                  or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'chr_atlas')
+
+
+def atlas_filename(rom, cache_dir=None):
+    """the cache file of the atlas of the given ROM"""
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    return os.path.join(cache_dir, 'chr_atlas_%s_2bpp.npy'
+                        % hashlib.sha1(rom).hexdigest())
+
+
+def load_atlas(filename='mario_ROM.zip', cache_dir=None):
+    """Load the tile atlas of a ROM, decoding and caching it if needed.
+
+    Parameters
+    ----------
+    filename : string
+        the ROM file, either raw or zipped
+    cache_dir : string, optional
+        the directory of the cached atlas.  Default is the chr_atlas
+        directory of the user cache ($XDG_CACHE_HOME or ~/.cache).  If
+        it cannot be written, the atlas is decoded on every call.
+
+    Returns
+    -------
+    tiles : TileAtlas
+        the color indices of the tiles, on a read-only packed array or
+        memmap
+    """
+    rom = read_rom(filename)
+    cache = atlas_filename(rom, cache_dir)
+    if not os.path.exists(cache):
+        tiles = pack_tiles(decode_tiles(rom))
+        try:
+            if not os.path.isdir(os.path.dirname(cache)):
+                os.makedirs(os.path.dirname(cache))
+            # write to a temporary file first, so that an interrupted
+            # write never leaves a truncated atlas behind
+            with open(cache + '.tmp', 'wb') as f:
+                np.save(f, tiles)
+            os.rename(cache + '.tmp', cache)
+        except (IOError, OSError):
+            if os.path.exists(cache + '.tmp'):
+                os.remove(cache + '.tmp')
+            tiles.flags.writeable = False
+            return TileAtlas(tiles)
+    return TileAtlas(np.load(cache, mmap_mode='r'))
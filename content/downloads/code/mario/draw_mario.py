@@ -4,23 +4,18 @@ By Jake Vanderplas, 2013 <http://jakevdp.github.com>
 License: GPL.
 Feel free to use and distribute, but keep this attribution intact.
 """
-import zipfile
 import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib.colors import ListedColormap
 
+from chr_atlas import load_atlas
+
 
 class NESGraphics(object):
     """Class interface for stripping graphics from an NES ROM"""
     def __init__(self, filename='mario_ROM.zip', offset=2049):
         self.offset = offset
-        if zipfile.is_zipfile(filename):
-            zp = zipfile.ZipFile(filename)
-            data = np.unpackbits(np.frombuffer(zp.read(zp.filelist[0]),
-                                               dtype=np.uint8))
-        else:
-            data = np.unpackbits(np.fromfile(filename, dtype=np.uint8))
-        self.data = data.reshape((-1, 8, 8))
+        self.tiles = load_atlas(filename)
 
     def generate_image(self, A, C=None, transparent=False):
         """Generate an image from the pattern table.
@@ -51,20 +46,19 @@ class NESGraphics(object):
         # broadcast C to the shape of A
         C = np.asarray(C) + np.zeros(A.shape + (1,))
 
-        im = np.zeros((8 * A.shape[0], 8 * A.shape[1]))
-        for i in range(A.shape[0]):
-            for j in range(A.shape[1]):
-                # extract bits
-                ind = 2 * (abs(A[i, j]) + self.offset)
-                thumb = self.data[ind] + 2 * self.data[ind + 1]
+        # gather the color indices of all tiles: shape A.shape + (8, 8)
+        thumbs = self.tiles[abs(A).astype(int) + self.offset]
+
+        # flip tiles with negative index
+        flip = A < 0
+        thumbs[flip] = thumbs[flip][:, :, ::-1]
 
-                # set bit colors
-                thumb = C[i, j, thumb]
+        # set bit colors: im[i, j] = C[i, j, thumbs[i, j]]
+        i, j = np.indices(A.shape)
+        im = C[i[:, :, None, None], j[:, :, None, None], thumbs]
 
-                # flip image if negative
-                if A[i, j] < 0:
-                    thumb = thumb[:, ::-1]
-                im[8 * i:8 * (i + 1), 8 * j:8 * (j + 1)] = thumb
+        # arrange the (8, 8) tiles into one image
+        im = im.transpose(0, 2, 1, 3).reshape(8 * A.shape[0], 8 * A.shape[1])
 
         if transparent:
             im = np.ma.masked_equal(im, 0)
@@ -0,0 +1,84 @@
+"""
+Benchmark the composition of NES images from tiles
+
+Plots the time for NESGraphics.generate_image to compose an image from
+an N x N map of tiles with random colors and flips, against the number
+of tiles, composing one tile at a time as in earlier versions of
+animate_mario.py and with the vectorized generate_image.  The largest
+map is the size of a 240 x 256 tile map.
+"""
+from time import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from animate_mario import NESGraphics
+
+
+def generate_image_loop(NG, A, C=None):
+    """compose the image tile by tile"""
+    A = np.asarray(A)
+    if C is None:
+        C = range(4)
+    C = np.asarray(C) + np.zeros(A.shape + (1,))
+
+    im = np.zeros((8 * A.shape[0], 8 * A.shape[1]))
+    for i in range(A.shape[0]):
+        for j in range(A.shape[1]):
+            thumb = C[i, j, NG.tiles[abs(A[i, j]) + NG.offset]]
+            if A[i, j] < 0:
+                thumb = thumb[:, ::-1]
+            im[8 * i:8 * (i + 1), 8 * j:8 * (j + 1)] = thumb
+    return im
+
+
+def random_map(shape, rseed=0):
+    """random tile indices (half of them flipped) and color tables"""
+    rng = np.random.RandomState(rseed)
+    A = rng.randint(0, 512, shape) * rng.choice([-1, 1], shape)
+    C = rng.randint(0, 10, shape + (4,))
+    return A, C
+
+
+def time_generate(func, shapes):
+    times = []
+    for shape in shapes:
+        A, C = random_map(shape)
+        t0 = time()
+        func(A, C)
+        t1 = time()
+        times.append(t1 - t0)
+    return np.array(times)
+
+
+def check_generate(NG, shape=(240, 256)):
+    """print whether the two methods give the same image"""
+    A, C = random_map(shape)
+    print("%i x %i map: images are equal: %s"
+          % (shape + (np.array_equal(generate_image_loop(NG, A, C),
+                                     NG.generate_image(A, C)),)))
+
+
+if __name__ == '__main__':
+    NG = NESGraphics()
+    check_generate(NG)
+
+    shapes = [(15, 16), (30, 32), (60, 64), (120, 128), (240, 256)]
+    N = np.array([s[0] * s[1] for s in shapes])
+
+    fig, ax = plt.subplots(subplot_kw=dict(xscale='log', yscale='log'))
+
+    print("computing times for the tile loop...")
+    ax.plot(N, time_generate(lambda A, C: generate_image_loop(NG, A, C),
+                             shapes), label='tile by tile')
+    print("computing times for generate_image...")
+    ax.plot(N, time_generate(NG.generate_image, shapes),
+            label='generate_image')
+
+    ax.legend(loc=2)
+    ax.set_xlabel('number of tiles')
+    ax.set_ylabel('t (s)')
+    ax.set_title('NES image composition')
+    ax.grid(color='gray')
+
+    plt.show()
@@ -1,8 +1,9 @@
-import zipfile
 import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib.colors import ListedColormap
 
+from chr_atlas import load_atlas
+
 BGCOLOR = '#AAAACC'
 background = ListedColormap([BGCOLOR])
 mario = ListedColormap([BGCOLOR, 'red', 'orange', 'brown'])
@@ -59,9 +60,7 @@ class MarioDisplay(object):
 
     def __init__(self, frames, filename='mario_ROM.zip',
                  pattern_offset=2049, cmap=plt.cm.binary):
-        zp = zipfile.ZipFile(filename)
-        self.data = np.unpackbits(np.frombuffer(zp.read(zp.filelist[0]),
-                                                dtype=np.uint8))
+        self.tiles = load_atlas(filename)
 
         self.frames = frames
         self.pattern_offset = pattern_offset
@@ -86,13 +85,12 @@ class MarioDisplay(object):
         self.im.set_clim(0, 3)
 
     def get_tile(self, offset, flatten=True):
-        bit_index = (offset + self.pattern_offset) * 128
-        thumb = self.data[bit_index:bit_index + 128].reshape((2, 8, 8))
+        thumb = self.tiles[offset + self.pattern_offset]
 
         if flatten:
-            return thumb[0] + 2 * thumb[1]
-        else:
             return thumb
+        else:
+            return np.array([thumb & 1, thumb >> 1])
 
     def _get_tiles(self, arr):
         arr = np.atleast_2d(arr)
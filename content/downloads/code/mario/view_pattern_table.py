@@ -6,22 +6,16 @@ By Jake Vanderplas, 2013 <http://jakevdp.github.com>
 License: GPL.
 Feel free to use and distribute, but keep this attribution intact.
 """
-import zipfile
 import numpy as np
 from matplotlib import pyplot as plt
 
+from chr_atlas import load_atlas
+
 
 class ROMViewer(object):
     """Visually inspect an NES ROM"""
     def __init__(self, filename, N1=16, N2=16, sep=1):
-        if zipfile.is_zipfile(filename):
-            zp = zipfile.ZipFile(filename)
-            data = np.unpackbits(np.frombuffer(zp.read(zp.filelist[0]),
-                                               dtype=np.uint8))
-        else:
-            data = np.unpackbits(np.fromfile(filename, dtype=np.uint8))
-
-        self.data = data.reshape((-1, 8, 8))
+        self.tiles = load_atlas(filename)
         self.N1 = N1
         self.N2 = N2
         self.sep = sep
@@ -36,18 +30,18 @@ class ROMViewer(object):
     def update_offset(self, offset):
         """update offset and re-draw figure"""
         offset = max(offset, 0)
-        offset = min(offset, self.data.shape[0] / 2 - self.N1 * self.N2)
+        offset = min(offset, self.tiles.shape[0] - self.N1 * self.N2)
         self.current_offset = offset
         self.ax.set_title('offset = %i' % offset)
 
-        # starting at offset, take 128-bit chunks and view as
-        # 2-bit 8x8 thumbnails in an 8x8 grid
+        # starting at offset, view the tiles as 2-bit 8x8 thumbnails
+        # in an N1 x N2 grid
         im_array = np.zeros((self.sep + self.N1 * (8 + self.sep),
                              self.sep + self.N2 * (8 + self.sep)))
 
         for i in range(self.N1):
             for j in range(self.N2):
-                thumb = self.data[2 * offset] + 2 * self.data[2 * offset + 1]
+                thumb = self.tiles[offset]
                 ind_i = self.sep + (8 + self.sep) * i
                 ind_j = self.sep + (8 + self.sep) * j
                 im_array[ind_i:ind_i + 8, ind_j:ind_j + 8] = thumb
@@ -65,8 +59,8 @@ class ROMViewer(object):
         offset_dict = dict(right=1, left=-1,
                            up=-self.N1 * self.N2,
                            down=self.N1 * self.N2,
-                           home=-self.data.shape[0],
-                           end=self.data.shape[0])
+                           home=-self.tiles.shape[0],
+                           end=self.tiles.shape[0])
 
         if event.key in offset_dict:
             self.update_offset(self.current_offset + offset_dict[event.key])
@@ -77,7 +71,7 @@ if __name__ == '__main__':
     try:
         filename = sys.argv[1]
     except:
-        print __doc__
+        print(__doc__)
         sys.exit(0)
 
     ROMViewer(filename)
@@ -0,0 +1,78 @@
+"""
+Streaming of fixed-shape frames to memory-mappable .npy files
+
+Shared by the snapshot recorder of schrodinger.py and the trajectory
+recorder of particle_box.py.
+
+author: Jake Vanderplas
+email: vanderplas@astro.washington.edu
+website: http://jakevdp.github.com
+license: BSD
+Please feel free to use and modify this, but keep the above information. Thanks!
+"""
+import struct
+
+import numpy as np
+
+
+class NpyStreamWriter(object):
+    """
+    Append frames of a fixed shape to a .npy file, one chunk at a time.
+
+    Only the current chunk is held in memory.  The header is rewritten
+    with the number of frames on every flush(), so that the file can be
+    memory-mapped with np.load(filename, mmap_mode='r') up to the last
+    flush even if the writer is never closed.
+
+    If n_frames is given, the existing file is reopened and appended to
+    after its first n_frames frames; any later frames are discarded.
+    """
+    # total size of magic string and header, so that it can be rewritten
+    # in place once the number of frames is known
+    header_size = 256
+
+    def __init__(self, filename, frame_shape, dtype, chunk_size=64,
+                 n_frames=None):
+        self.filename = filename
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk = np.empty((chunk_size,) + self.frame_shape, self.dtype)
+        self.n_chunk = 0
+        if n_frames is None:
+            self.n_frames = 0
+            self.fh = open(filename, 'wb')
+        else:
+            self.n_frames = n_frames
+            self.fh = open(filename, 'r+b')
+            self.fh.truncate(self.header_size
+                             + n_frames * self.chunk[0].nbytes)
+        self._write_header()
+
+    def _write_header(self):
+        header = ("{'descr': %r, 'fortran_order': False, 'shape': %r, }"
+                  % (np.lib.format.dtype_to_descr(self.dtype),
+                     (self.n_frames,) + self.frame_shape))
+        header = header.ljust(self.header_size - 11) + '\n'
+        self.fh.seek(0)
+        self.fh.write(b'\x93NUMPY\x01\x00')
+        self.fh.write(struct.pack('<H', len(header)))
+        self.fh.write(header.encode('latin1'))
+
+    def append(self, frame):
+        self.chunk[self.n_chunk] = frame
+        self.n_chunk += 1
+        self.n_frames += 1
+        if self.n_chunk == len(self.chunk):
+            self.flush()
+
+    def flush(self):
+        """write the frames of the current chunk to disk"""
+        self.fh.seek(0, 2)
+        self.fh.write(self.chunk[:self.n_chunk].tobytes())
+        self.n_chunk = 0
+        self._write_header()
+        self.fh.flush()
+
+    def close(self):
+        self.flush()
+        self.fh.close()
@@ -7,13 +7,259 @@ website: http://jakevdp.github.com
 license: BSD
 Please feel free to use and modify this, but keep the above information. Thanks!
 """
+from heapq import heappush, heappop
+import os
+
 import numpy as np
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import pdist, squareform
 
 import matplotlib.pyplot as plt
 import scipy.integrate as integrate
 import matplotlib.animation as animation
 
+from npy_stream import NpyStreamWriter
+
+
+#------------------------------------------------------------
+# Neighbour search: each function returns the index arrays (ind1, ind2)
+# of all pairs of points closer than r, with ind1 < ind2, sorted by
+# (ind1, ind2).
+
+def pairs_pdist(X, r, bounds=None):
+    """all-pairs search on the full distance matrix: O(N^2)"""
+    D = squareform(pdist(X))
+    ind1, ind2 = np.where(D < r)
+    unique = (ind1 < ind2)
+    return ind1[unique], ind2[unique]
+
+
+def pairs_kdtree(X, r, bounds=None):
+    """radius search with a k-d tree: O(N log N)"""
+    pairs = cKDTree(X).query_pairs(r, output_type='ndarray')
+    ind1, ind2 = pairs[:, 0], pairs[:, 1]
+    D = np.sqrt(((X[ind1] - X[ind2]) ** 2).sum(1))
+    return _sort_pairs(ind1[D < r], ind2[D < r])
+
+
+# offsets of the neighbouring cells, each cell pair is visited once
+_CELL_OFFSETS = [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]
+
+
+def pairs_cells(X, r, bounds):
+    """search on a uniform grid of cells of size r: O(N) at fixed density"""
+    # assign each point to a cell.  Points outside the box are put in the
+    # nearest edge cell, which still holds all of their neighbours.
+    nx = max(int((bounds[1] - bounds[0]) / r), 1)
+    ny = max(int((bounds[3] - bounds[2]) / r), 1)
+    cx = np.clip(((X[:, 0] - bounds[0]) / r).astype(int), 0, nx - 1)
+    cy = np.clip(((X[:, 1] - bounds[2]) / r).astype(int), 0, ny - 1)
+
+    order = np.argsort(cx * ny + cy, kind='mergesort')
+    keys = (cx * ny + cy)[order]
+
+    ind1 = []
+    ind2 = []
+    for dx, dy in _CELL_OFFSETS:
+        # the range of sorted points lying in the neighbouring cell
+        nbx = cx[order] + dx
+        nby = cy[order] + dy
+        valid = (nbx < nx) & (nby >= 0) & (nby < ny)
+        nb_keys = nbx * ny + nby
+        start = np.searchsorted(keys, nb_keys, side='left')
+        count = np.searchsorted(keys, nb_keys, side='right') - start
+        count[~valid] = 0
+
+        # expand into one candidate pair per point in that cell
+        i = np.repeat(np.arange(len(keys)), count)
+        first = np.repeat(start - np.cumsum(count) + count, count)
+        j = first + np.arange(len(i))
+        if (dx, dy) == (0, 0):
+            keep = (i < j)
+            i, j = i[keep], j[keep]
+        ind1.append(order[i])
+        ind2.append(order[j])
+
+    ind1 = np.concatenate(ind1)
+    ind2 = np.concatenate(ind2)
+    D = np.sqrt(((X[ind1] - X[ind2]) ** 2).sum(1))
+    close = (D < r)
+    ind1, ind2 = ind1[close], ind2[close]
+    return _sort_pairs(np.minimum(ind1, ind2), np.maximum(ind1, ind2))
+
+
+def pairs_polydisperse(X, R, bounds=None, find_pairs=pairs_cells, ratio=2.):
+    """
+    pairs of touching discs with radii R.  The discs are binned into
+    levels of radii within a factor ratio of each other: the pairs within
+    a level are found by find_pairs with a range set by the largest disc
+    of that level, and the pairs across two levels by a k-d tree search
+    between them, so small discs are never searched at the range of the
+    largest ones.
+    """
+    R = np.asarray(R, dtype=float)
+    if bounds is None:
+        bounds = [X[:, 0].min(), X[:, 0].max(), X[:, 1].min(), X[:, 1].max()]
+    level = np.floor(np.log(R / R.min()) / np.log(ratio)).astype(int)
+    members = [np.where(level == l)[0] for l in np.unique(level)]
+    trees = [cKDTree(X[m]) for m in members]
+
+    ind1 = []
+    ind2 = []
+    for a, ma in enumerate(members):
+        i, j = find_pairs(X[ma], 2 * R[ma].max(), bounds)
+        ind1.append(ma[i])
+        ind2.append(ma[j])
+        for b in range(a + 1, len(members)):
+            mb = members[b]
+            pairs = trees[a].sparse_distance_matrix(
+                trees[b], R[ma].max() + R[mb].max(), output_type='ndarray')
+            ind1.append(ma[pairs['i']])
+            ind2.append(mb[pairs['j']])
+
+    ind1 = np.concatenate(ind1)
+    ind2 = np.concatenate(ind2)
+    D = np.sqrt(((X[ind1] - X[ind2]) ** 2).sum(1))
+    close = (D < R[ind1] + R[ind2])
+    ind1, ind2 = ind1[close], ind2[close]
+    return _sort_pairs(np.minimum(ind1, ind2), np.maximum(ind1, ind2))
+
+
+def _sort_pairs(ind1, ind2):
+    order = np.lexsort((ind2, ind1))
+    return ind1[order], ind2[order]
+
+
+NEIGHBOR_SEARCH = {'pdist': pairs_pdist,
+                   'kdtree': pairs_kdtree,
+                   'cells': pairs_cells}
+
+
+#------------------------------------------------------------
+# Collision response: each function updates the velocities in state for
+# the colliding pairs (ind1, ind2) of particles with masses M.
+
+def _collision_velocities(state, M, ind1, ind2):
+    """velocities of each pair after an elastic collision"""
+    m1 = M[ind1, None]
+    m2 = M[ind2, None]
+
+    # relative location & velocity vectors
+    r_rel = state[ind1, :2] - state[ind2, :2]
+    v_rel = state[ind1, 2:] - state[ind2, 2:]
+
+    # momentum vector of the center of mass
+    v_cm = (m1 * state[ind1, 2:] + m2 * state[ind2, 2:]) / (m1 + m2)
+
+    # collisions of spheres reflect v_rel over r_rel
+    rr_rel = (r_rel * r_rel).sum(1)[:, None]
+    vr_rel = (v_rel * r_rel).sum(1)[:, None]
+    v_rel = 2 * r_rel * vr_rel / rr_rel - v_rel
+
+    return v_cm + v_rel * m2 / (m1 + m2), v_cm - v_rel * m1 / (m1 + m2)
+
+
+def collide_loop(state, M, ind1, ind2):
+    """resolve the pairs one at a time, in order"""
+    for i1, i2 in zip(ind1, ind2):
+        # mass
+        m1 = M[i1]
+        m2 = M[i2]
+
+        # location vector
+        r1 = state[i1, :2]
+        r2 = state[i2, :2]
+
+        # velocity vector
+        v1 = state[i1, 2:]
+        v2 = state[i2, 2:]
+
+        # relative location & velocity vectors
+        r_rel = r1 - r2
+        v_rel = v1 - v2
+
+        # momentum vector of the center of mass
+        v_cm = (m1 * v1 + m2 * v2) / (m1 + m2)
+
+        # collisions of spheres reflect v_rel over r_rel
+        rr_rel = np.dot(r_rel, r_rel)
+        vr_rel = np.dot(v_rel, r_rel)
+        v_rel = 2 * r_rel * vr_rel / rr_rel - v_rel
+
+        # assign new velocities
+        state[i1, 2:] = v_cm + v_rel * m2 / (m1 + m2)
+        state[i2, 2:] = v_cm - v_rel * m1 / (m1 + m2)
+
+
+def collide_sequential(state, M, ind1, ind2):
+    """
+    resolve the pairs with the same result as collide_loop (up to
+    rounding), in rounds of pairs which share no particle
+    """
+    pair = np.arange(len(ind1))
+    while len(pair):
+        # a pair is ready once all earlier pairs involving either of its
+        # particles have been resolved
+        first = np.full(len(state), len(ind1))
+        np.minimum.at(first, ind1[pair], pair)
+        np.minimum.at(first, ind2[pair], pair)
+        ready = (first[ind1[pair]] == pair) & (first[ind2[pair]] == pair)
+
+        i1 = ind1[pair[ready]]
+        i2 = ind2[pair[ready]]
+        state[i1, 2:], state[i2, 2:] = _collision_velocities(state, M, i1, i2)
+        pair = pair[~ready]
+
+
+def collide_simultaneous(state, M, ind1, ind2):
+    """
+    resolve all pairs at once from the velocities before the collisions.
+    The velocity changes of a pair are divided by the larger number of
+    contacts of its two particles, and added up for each particle.
+    """
+    v1, v2 = _collision_velocities(state, M, ind1, ind2)
+    contacts = np.bincount(np.concatenate([ind1, ind2]),
+                           minlength=len(state))
+    weight = 1. / np.maximum(contacts[ind1], contacts[ind2])[:, None]
+
+    velocity = state[:, 2:]
+    dv1 = weight * (v1 - velocity[ind1])
+    dv2 = weight * (v2 - velocity[ind2])
+    np.add.at(velocity, ind1, dv1)
+    np.add.at(velocity, ind2, dv2)
+
+
+COLLISIONS = {'loop': collide_loop,
+              'sequential': collide_sequential,
+              'simultaneous': collide_simultaneous}
+
+
+#------------------------------------------------------------
+# Walls and gravity
+
+def walls_and_gravity(state, M, size, bounds, G, dt):
+    """
+    reflect the particles of radius size (a single radius, or one per
+    particle) which crossed the walls of the box, and add gravity
+    """
+    size = size * np.ones(state.shape[0])
+    crossed_x1 = (state[:, 0] < bounds[0] + size)
+    crossed_x2 = (state[:, 0] > bounds[1] - size)
+    crossed_y1 = (state[:, 1] < bounds[2] + size)
+    crossed_y2 = (state[:, 1] > bounds[3] - size)
+
+    state[crossed_x1, 0] = bounds[0] + size[crossed_x1]
+    state[crossed_x2, 0] = bounds[1] - size[crossed_x2]
+
+    state[crossed_y1, 1] = bounds[2] + size[crossed_y1]
+    state[crossed_y2, 1] = bounds[3] - size[crossed_y2]
+
+    state[crossed_x1 | crossed_x2, 2] *= -1
+    state[crossed_y1 | crossed_y2, 3] *= -1
+
+    state[:, 3] -= M * G * dt
+
+
 class ParticleBox:
     """Orbits class
     
@@ -23,6 +269,24 @@ class ParticleBox:
         ...               ]
 
     bounds is the size of the box: [xmin, xmax, ymin, ymax]
+
+    size is the radius of the particles, or an array of N radii.
+
+    neighbors is the name of the neighbour search used to find colliding
+    pairs: 'cells' (uniform cell list), 'kdtree' (scipy cKDTree) or
+    'pdist' (full distance matrix).  For particles of different sizes it
+    is used within each level of pairs_polydisperse.
+
+    collisions is the name of the collision response:
+      'sequential'   : pairs are resolved in order, as by a loop over the
+                       pairs, but vectorized over rounds of disjoint pairs
+      'simultaneous' : all pairs are resolved at once, and the velocity
+                       changes of particles in several contacts are added
+      'loop'         : a plain Python loop over the pairs
+    All three agree for particles in a single contact, and conserve
+    momentum.  'sequential' and 'loop' also conserve energy;
+    'simultaneous' does not depend on the order of the pairs, but loses
+    some energy in multiple contacts.
     """
     def __init__(self,
                  init_state = [[1, 0, 0, -1],
@@ -31,7 +295,9 @@ class ParticleBox:
                  bounds = [-2, 2, -2, 2],
                  size = 0.04,
                  M = 0.05,
-                 G = 9.8):
+                 G = 9.8,
+                 neighbors = 'cells',
+                 collisions = 'sequential'):
         self.init_state = np.asarray(init_state, dtype=float)
         self.M = M * np.ones(self.init_state.shape[0])
         self.size = size
@@ -39,6 +305,19 @@ class ParticleBox:
         self.time_elapsed = 0
         self.bounds = bounds
         self.G = G
+        self.neighbors = neighbors
+        self.collisions = collisions
+        self.find_pairs = NEIGHBOR_SEARCH[neighbors]
+        self.collide = COLLISIONS[collisions]
+        self.step_count = 0
+        self.monitors = []
+
+    def add_monitor(self, monitor):
+        """
+        Add a monitor, such as a TrajectoryRecorder or a Checkpointer.
+        monitor.record(self) is called after every monitor.every steps.
+        """
+        self.monitors.append(monitor)
 
     def step(self, dt):
         """step once by dt seconds"""
@@ -48,118 +327,539 @@ class ParticleBox:
         self.state[:, :2] += dt * self.state[:, 2:]
 
         # find pairs of particles undergoing a collision
-        D = squareform(pdist(self.state[:, :2]))
-        ind1, ind2 = np.where(D < 2 * self.size)
-        unique = (ind1 < ind2)
-        ind1 = ind1[unique]
-        ind2 = ind2[unique]
+        if np.ndim(self.size) == 0:
+            ind1, ind2 = self.find_pairs(self.state[:, :2], 2 * self.size,
+                                         self.bounds)
+        else:
+            ind1, ind2 = pairs_polydisperse(self.state[:, :2], self.size,
+                                            self.bounds, self.find_pairs)
 
         # update velocities of colliding pairs
-        for i1, i2 in zip(ind1, ind2):
-            # mass
-            m1 = self.M[i1]
-            m2 = self.M[i2]
+        self.collide(self.state, self.M, ind1, ind2)
 
-            # location vector
-            r1 = self.state[i1, :2]
-            r2 = self.state[i2, :2]
+        # check for crossing boundary, and add gravity
+        walls_and_gravity(self.state, self.M, self.size, self.bounds,
+                          self.G, dt)
 
-            # velocity vector
-            v1 = self.state[i1, 2:]
-            v2 = self.state[i2, 2:]
+        self.step_count += 1
+        for monitor in self.monitors:
+            if self.step_count % monitor.every == 0:
+                monitor.record(self)
 
-            # relative location & velocity vectors
-            r_rel = r1 - r2
-            v_rel = v1 - v2
 
-            # momentum vector of the center of mass
-            v_cm = (m1 * v1 + m2 * v2) / (m1 + m2)
+#------------------------------------------------------------
+# Recording long runs: the trajectory is streamed to a memory-mappable
+# .npy file, and checkpoints allow a run to be resumed exactly.
 
-            # collisions of spheres reflect v_rel over r_rel
-            rr_rel = np.dot(r_rel, r_rel)
-            vr_rel = np.dot(v_rel, r_rel)
-            v_rel = 2 * r_rel * vr_rel / rr_rel - v_rel
+class TrajectoryRecorder(object):
+    """
+    Record the particle positions of a ParticleBox run to disk.
 
-            # assign new velocities
-            self.state[i1, 2:] = v_cm + v_rel * m2 / (m1 + m2)
-            self.state[i2, 2:] = v_cm - v_rel * m1 / (m1 + m2) 
+    Add the recorder with ParticleBox.add_monitor().  Every `every`
+    steps, the positions of every decimate-th particle are converted to
+    dtype and appended to filename + '.npy', and the time to
+    filename + '_t.npy'.  The files can be memory-mapped up to the last
+    chunk written, and with load_trajectory() once closed.
 
-        # check for crossing boundary
-        crossed_x1 = (self.state[:, 0] < self.bounds[0] + self.size)
-        crossed_x2 = (self.state[:, 0] > self.bounds[1] - self.size)
-        crossed_y1 = (self.state[:, 1] < self.bounds[2] + self.size)
-        crossed_y2 = (self.state[:, 1] > self.bounds[3] - self.size)
+    With resume=True, the recorder continues the files of a run resumed
+    from a checkpoint, dropping any frames recorded after it.
+    """
+    def __init__(self, filename, every=1, dtype=np.float32, decimate=1,
+                 chunk_size=64, resume=False):
+        self.filename = filename
+        self.every = every
+        self.dtype = dtype
+        self.decimate = decimate
+        self.chunk_size = chunk_size
+        self.resume = resume
+        self.data_writer = None
+        self.t_writer = None
+
+    def record(self, box):
+        """append the positions of the ParticleBox box"""
+        frame = box.state[::self.decimate, :2]
+
+        if self.data_writer is None:
+            # frames recorded before this one, if the run was resumed
+            n_frames = None
+            if self.resume:
+                n_frames = box.step_count // self.every - 1
+            self.data_writer = NpyStreamWriter(self.filename + '.npy',
+                                               frame.shape, self.dtype,
+                                               self.chunk_size, n_frames)
+            self.t_writer = NpyStreamWriter(self.filename + '_t.npy',
+                                            (), float, self.chunk_size,
+                                            n_frames)
+        self.data_writer.append(frame)
+        self.t_writer.append(box.time_elapsed)
+
+    def flush(self):
+        if self.data_writer is not None:
+            self.data_writer.flush()
+            self.t_writer.flush()
+
+    def close(self):
+        if self.data_writer is not None:
+            self.data_writer.close()
+            self.t_writer.close()
+
+
+def load_trajectory(filename):
+    """
+    Memory-map the positions written by a TrajectoryRecorder: return the
+    times, and an [n_frames x N x 2] array of positions.
+    """
+    return (np.load(filename + '_t.npy'),
+            np.load(filename + '.npy', mmap_mode='r'))
 
-        self.state[crossed_x1, 0] = self.bounds[0] + self.size
-        self.state[crossed_x2, 0] = self.bounds[1] - self.size
 
-        self.state[crossed_y1, 1] = self.bounds[2] + self.size
-        self.state[crossed_y2, 1] = self.bounds[3] - self.size
+class Checkpointer(object):
+    """
+    Save a checkpoint of a ParticleBox run every `every` steps.
 
-        self.state[crossed_x1 | crossed_x2, 2] *= -1
-        self.state[crossed_y1 | crossed_y2, 3] *= -1
+    Add the checkpointer with ParticleBox.add_monitor(), after any
+    recorders: these are flushed first, so that the files on disk always
+    reach at least as far as the checkpoint.  rng is the RandomState
+    (if any) driving the run, whose state is saved with the box.
+    """
+    def __init__(self, filename, every=1000, rng=None):
+        self.filename = filename
+        self.every = every
+        self.rng = rng
 
-        # add gravity
-        self.state[:, 3] -= self.M * self.G * dt
+    def record(self, box):
+        for monitor in box.monitors:
+            if hasattr(monitor, 'flush'):
+                monitor.flush()
+        save_checkpoint(box, self.filename, self.rng)
 
 
-#------------------------------------------------------------
-# set up initial state
-np.random.seed(0)
-init_state = -0.5 + np.random.random((50, 4))
-init_state[:, :2] *= 3.9
+def save_checkpoint(box, filename, rng=None):
+    """
+    Save the state of the ParticleBox box, and of the RandomState rng,
+    to the .npz file filename.  The file is written under a temporary
+    name and then renamed, so that a run killed while saving leaves the
+    previous checkpoint intact.
+    """
+    data = dict(init_state=box.init_state, state=box.state, M=box.M,
+                size=box.size, bounds=box.bounds, G=box.G,
+                time_elapsed=box.time_elapsed, step_count=box.step_count,
+                neighbors=box.neighbors, collisions=box.collisions)
+    if rng is not None:
+        name, keys, pos, has_gauss, cached_gaussian = rng.get_state()
+        data.update(rng_name=name, rng_keys=keys, rng_pos=pos,
+                    rng_has_gauss=has_gauss,
+                    rng_cached_gaussian=cached_gaussian)
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **data)
+    os.rename(tmp, filename)
+
+
+def load_checkpoint(filename, rng=None):
+    """
+    Return the ParticleBox saved in filename by save_checkpoint(), and
+    restore the state of the RandomState rng saved with it.  Stepping the
+    box then continues the run exactly as if it had not been stopped.
+    """
+    data = np.load(filename)
+    size = data['size']
+    if size.ndim == 0:
+        size = float(size)
+
+    box = ParticleBox(data['init_state'], list(data['bounds']), size,
+                      G=float(data['G']),
+                      neighbors=str(data['neighbors']),
+                      collisions=str(data['collisions']))
+    box.state = data['state'].copy()
+    box.M = data['M'].copy()
+    box.time_elapsed = float(data['time_elapsed'])
+    box.step_count = int(data['step_count'])
+
+    if rng is not None:
+        rng.set_state((str(data['rng_name']), data['rng_keys'],
+                       int(data['rng_pos']), int(data['rng_has_gauss']),
+                       float(data['rng_cached_gaussian'])))
+    return box
+
+
+class ParticleBoxEnsemble:
+    """E independent ParticleBoxes stepped together
+
+    init_state is an [E x N x 4] array holding the state of each of the
+    E boxes, in the layout used by ParticleBox.
+
+    bounds may be a single box [xmin, xmax, ymin, ymax] or an [E x 4]
+    array, size and G may be scalars or length-E arrays, and M may be a
+    scalar, a length-E array or an [E x N] array of masses.  neighbors
+    and collisions are as for ParticleBox.
+
+    The moves, wall reflections and gravity are done for all boxes at
+    once.  For the collisions, the boxes are laid out side by side and
+    searched for pairs together, so one call of the neighbour search and
+    of the collision response serves the whole ensemble.
+    """
+    def __init__(self,
+                 init_state,
+                 bounds = [-2, 2, -2, 2],
+                 size = 0.04,
+                 M = 0.05,
+                 G = 9.8,
+                 neighbors = 'cells',
+                 collisions = 'sequential'):
+        self.init_state = np.asarray(init_state, dtype=float)
+        E, N = self.init_state.shape[:2]
+        self.state = self.init_state.copy()
+        self.time_elapsed = 0
+        self.bounds = np.broadcast_to(np.asarray(bounds, dtype=float),
+                                      (E, 4)).copy()
+        self.size = np.broadcast_to(np.asarray(size, dtype=float), E).copy()
+        self.G = np.broadcast_to(np.asarray(G, dtype=float), E).copy()
+
+        M = np.asarray(M, dtype=float)
+        if M.ndim == 1:
+            M = M[:, None]
+        self.M = M * np.ones((E, N))
+
+        self.n_collisions = np.zeros(E, dtype=int)
+        self.find_pairs = NEIGHBOR_SEARCH[neighbors]
+        self.collide = COLLISIONS[collisions]
+
+    def find_collisions(self):
+        """return the colliding pairs as indices into the flattened state"""
+        E, N = self.state.shape[:2]
+        r = 2 * self.size.max()
+        X = self.state[:, :, :2].copy()
+
+        # shift each box along x so that their particles are at least r
+        # apart: no pair found then spans two boxes
+        xmin = X[:, :, 0].min(1)
+        width = X[:, :, 0].max(1) - xmin + 2 * r
+        X[:, :, 0] += (np.cumsum(width) - width - xmin)[:, None]
+
+        X = X.reshape(E * N, 2)
+        bounds = [0, width.sum(), X[:, 1].min(), X[:, 1].max() + r]
+        ind1, ind2 = self.find_pairs(X, r, bounds)
+
+        # each box has its own particle size
+        e = ind1 // N
+        D = np.sqrt(((X[ind1] - X[ind2]) ** 2).sum(1))
+        close = (D < 2 * self.size[e])
+        return ind1[close], ind2[close]
 
-box = ParticleBox(init_state, size=0.04)
-dt = 1. / 30 # 30fps
+    def step(self, dt):
+        """step all boxes once by dt seconds"""
+        E, N = self.state.shape[:2]
+        self.time_elapsed += dt
 
+        # update positions
+        self.state[:, :, :2] += dt * self.state[:, :, 2:]
 
-#------------------------------------------------------------
-# set up figure and animation
-fig = plt.figure()
-fig.subplots_adjust(left=0, right=1, bottom=0, top=1)
-ax = fig.add_subplot(111, aspect='equal', autoscale_on=False,
-                     xlim=(-3.2, 3.2), ylim=(-2.4, 2.4))
-
-# particles holds the locations of the particles
-particles, = ax.plot([], [], 'bo', ms=6)
-
-# rect is the box edge
-rect = plt.Rectangle(box.bounds[::2],
-                     box.bounds[1] - box.bounds[0],
-                     box.bounds[3] - box.bounds[2],
-                     ec='none', lw=2, fc='none')
-ax.add_patch(rect)
-
-def init():
-    """initialize animation"""
-    global box, rect
-    particles.set_data([], [])
-    rect.set_edgecolor('none')
-    return particles, rect
-
-def animate(i):
-    """perform animation step"""
-    global box, rect, dt, ax, fig
-    box.step(dt)
-
-    ms = int(fig.dpi * 2 * box.size * fig.get_figwidth()
-             / np.diff(ax.get_xbound())[0])
-    
-    # update pieces of the animation
-    rect.set_edgecolor('k')
-    particles.set_data(box.state[:, 0], box.state[:, 1])
-    particles.set_markersize(ms)
-    return particles, rect
+        # find pairs of particles undergoing a collision, and update
+        # their velocities
+        ind1, ind2 = self.find_collisions()
+        self.n_collisions = np.bincount(ind1 // N, minlength=E)
+        self.collide(self.state.reshape(E * N, 4), self.M.ravel(), ind1, ind2)
 
-ani = animation.FuncAnimation(fig, animate, frames=600,
-                              interval=10, blit=True, init_func=init)
+        # check for crossing boundary
+        size = self.size[:, None]
+        lower = self.bounds[:, None, ::2] + size[:, :, None]
+        upper = self.bounds[:, None, 1::2] - size[:, :, None]
+        position = self.state[:, :, :2]
+        crossed = (position < lower) | (position > upper)
+        np.clip(position, lower, upper, out=position)
+        self.state[:, :, 2:][crossed] *= -1
 
+        # add gravity
+        self.state[:, :, 3] -= self.M * self.G[:, None] * dt
+
+    def energy(self):
+        """kinetic and potential energy of each box"""
+        kinetic = 0.5 * (self.M * (self.state[:, :, 2:] ** 2).sum(2)).sum(1)
+        height = self.state[:, :, 1] - self.bounds[:, 2, None]
+        potential = (self.M ** 2 * self.G[:, None] * height).sum(1)
+        return kinetic, potential
+
+    def run(self, dt, Nsteps):
+        """
+        step all boxes Nsteps times by dt seconds without drawing, and
+        return a dictionary of [Nsteps x E] arrays of summary statistics:
+          't'          : time after each step
+          'kinetic'    : kinetic energy of each box
+          'potential'  : potential energy, from the bottom of each box
+          'y_mean'     : mean height of the particles
+          'collisions' : number of colliding pairs in the step
+        """
+        E = self.state.shape[0]
+        stats = dict((key, np.zeros((Nsteps, E)))
+                     for key in ['t', 'kinetic', 'potential', 'y_mean',
+                                 'collisions'])
+        for i in range(Nsteps):
+            self.step(dt)
+            stats['t'][i] = self.time_elapsed
+            stats['kinetic'][i], stats['potential'][i] = self.energy()
+            stats['y_mean'][i] = self.state[:, :, 1].mean(1)
+            stats['collisions'][i] = self.n_collisions
+        return stats
+
+
+class EventDrivenBox:
+    """Event-driven version of ParticleBox
+
+    Rather than stepping all particles by a fixed dt and looking for
+    overlaps, the box predicts the time of every particle-particle and
+    particle-wall collision, keeps them in a priority queue, and jumps
+    from one collision to the next.  Between collisions the particles
+    move on exact free-fall trajectories, so no collision is missed, and
+    step(dt) only has to extrapolate the particles to the frame boundary.
+    The work is proportional to the number of collisions rather than to
+    the number of particles times the number of frames, which is far
+    less for a dilute gas.
+
+    Events are invalidated lazily: each event records the collision
+    counts of its particles when it was predicted, and is discarded when
+    it is popped if either particle has collided since.
+
+    The arguments and the state / time_elapsed attributes are those of
+    ParticleBox.  As in ParticleBox.step, particle i is accelerated
+    downward by M[i] * G.  Colliding pairs are reflected along the line
+    of centres at the moment of contact: ParticleBox resolves overlaps
+    after the fact, and its rule exchanges the outcomes of the two
+    particles, which looks the same for equal masses but would leave
+    touching particles moving into each other here.
+    """
+    def __init__(self,
+                 init_state = [[1, 0, 0, -1],
+                               [-0.5, 0.5, 0.5, 0.5],
+                               [-0.5, -0.5, -0.5, 0.5]],
+                 bounds = [-2, 2, -2, 2],
+                 size = 0.04,
+                 M = 0.05,
+                 G = 9.8):
+        self.init_state = np.asarray(init_state, dtype=float)
+        self.M = M * np.ones(self.init_state.shape[0])
+        self.size = size
+        self.state = self.init_state.copy()
+        self.time_elapsed = 0
+        self.bounds = bounds
+        self.G = G
 
-# save the animation as an mp4.  This requires ffmpeg or mencoder to be
-# installed.  The extra_args ensure that the x264 codec is used, so that
-# the video can be embedded in html5.  You may need to adjust this for
-# your system: for more information, see
-# http://matplotlib.sourceforge.net/api/animation_api.html
-#ani.save('particle_box.mp4', fps=30, extra_args=['-vcodec', 'libx264'])
+        # each particle is stored at the time of its last collision
+        N = self.state.shape[0]
+        self.radius = size * np.ones(N)
+        self.ref_state = self.state.copy()
+        self.ref_time = np.zeros(N)
+        self.counts = np.zeros(N, dtype=int)
+        self.n_events = 0
+        self.events = []
+        for i in range(N):
+            self._predict(i, 0.)
+
+    def _state_at(self, t, i=slice(None)):
+        """free-fall the particles i from their reference time to t"""
+        tau = t - self.ref_time[i]
+        s = self.ref_state[i].copy()
+        g = self.M[i] * self.G
+        s[..., 0] += s[..., 2] * tau
+        s[..., 1] += s[..., 3] * tau - 0.5 * g * tau ** 2
+        s[..., 3] -= g * tau
+        return s
+
+    def _wall_time(self, s, g, size):
+        """time until a particle at s hits a wall, and the wall hit"""
+        xmin, xmax, ymin, ymax = self.bounds
+        x, y, vx, vy = s
+        eps = 1E-12
+        times = [np.inf] * 4
+
+        if vx < 0:
+            times[0] = (xmin + size - x) / vx
+        elif vx > 0:
+            times[1] = (xmax - size - x) / vx
+
+        # solve y + vy t - g t^2 / 2 = wall for the first root t > 0
+        for wall, y_wall in [(2, ymin + size), (3, ymax - size)]:
+            if g == 0:
+                if vy != 0 and (y_wall - y) / vy > eps:
+                    times[wall] = (y_wall - y) / vy
+                continue
+            disc = vy ** 2 - 2 * g * (y_wall - y)
+            if disc < 0:
+                continue
+            for root in sorted([(vy - np.sqrt(disc)) / g,
+                                (vy + np.sqrt(disc)) / g]):
+                if root > eps:
+                    times[wall] = root
+                    break
+
+        wall = int(np.argmin(times))
+        return max(times[wall], 0), wall
+
+    def _pair_times(self, i, S, t_max):
+        """times until particle i hits each of the particles in S"""
+        sigma = self.radius[i] + self.radius
+        g = self.M * self.G
+        dr = S[:, :2] - S[i, :2]
+        dv = S[:, 2:] - S[i, 2:]
+        da = g[i] - g
+
+        # approaching pairs with no relative acceleration:
+        # solve |dr + dv t|^2 = sigma^2
+        b = (dr * dv).sum(1)
+        vv = (dv ** 2).sum(1)
+        rr = (dr ** 2).sum(1) - sigma ** 2
+        disc = b ** 2 - vv * rr
+        times = np.inf * np.ones(len(S))
+        hit = (b < 0) & (disc >= 0) & (da == 0)
+        times[hit] = np.maximum(rr[hit], 0) / (-b[hit] + np.sqrt(disc[hit]))
+
+        # pairs falling at different rates: the vertical separation
+        # gains da t^2 / 2, so solve the quartic for those pairs which
+        # can come into contact before t_max
+        reach = np.sqrt(vv) * t_max + 0.5 * abs(da) * t_max ** 2
+        close = (rr < (2 * sigma + reach) * reach)
+        for j in np.where((da != 0) & close)[0]:
+            x, y = dr[j]
+            vx, vy = dv[j]
+            a = 0.5 * da[j]
+            roots = np.roots([a ** 2, 2 * a * vy,
+                              vx ** 2 + vy ** 2 + 2 * a * y,
+                              2 * (x * vx + y * vy), rr[j]])
+            roots = roots.real[(abs(roots.imag) < 1E-12) & (roots.real >= 0)]
+            for root in np.sort(roots):
+                # keep the contacts where the pair is approaching
+                dy = y + (vy + a * root) * root
+                if (x + vx * root) * vx + dy * (vy + 2 * a * root) < 0:
+                    times[j] = root
+                    break
+
+        times[i] = np.inf
+        return times
+
+    def _predict(self, i, t):
+        """push the next wall collision of particle i, and its collisions
+        with other particles before then"""
+        S = self._state_at(t)
+        t_wall, wall = self._wall_time(S[i], self.M[i] * self.G,
+                                       self.radius[i])
+        heappush(self.events, (t + t_wall, i, -1, self.counts[i], 0, wall))
+
+        # a later collision with a particle will be predicted again once
+        # particle i has bounced off the wall
+        times = self._pair_times(i, S, t_wall)
+        for j in np.where(times < t_wall)[0]:
+            heappush(self.events, (t + times[j], i, j,
+                                   self.counts[i], self.counts[j], -1))
+
+    def _collide(self, t, i, j, wall):
+        """resolve a collision of particle i with particle j or a wall"""
+        if j < 0:
+            s = self._state_at(t, i)
+            s[wall // 2 + 2] *= -1
+            s[wall // 2] = (self.bounds[wall]
+                            + (1 - 2 * (wall % 2)) * self.radius[i])
+            self.ref_state[i] = s
+            self.ref_time[i] = t
+            self.counts[i] += 1
+            self._predict(i, t)
+            return
+
+        s1 = self._state_at(t, i)
+        s2 = self._state_at(t, j)
+        m1 = self.M[i]
+        m2 = self.M[j]
+
+        # reflect the relative velocity along the line of centres
+        r_rel = s1[:2] - s2[:2]
+        v_rel = s1[2:] - s2[2:]
+        dv = 2 * np.dot(v_rel, r_rel) / np.dot(r_rel, r_rel) * r_rel
+        s1[2:] -= dv * m2 / (m1 + m2)
+        s2[2:] += dv * m1 / (m1 + m2)
+
+        self.ref_state[i] = s1
+        self.ref_state[j] = s2
+        self.ref_time[i] = self.ref_time[j] = t
+        self.counts[i] += 1
+        self.counts[j] += 1
+        self._predict(i, t)
+        self._predict(j, t)
 
-plt.show()
+    def step(self, dt):
+        """step once by dt seconds"""
+        t_frame = self.time_elapsed + dt
+
+        while self.events and self.events[0][0] <= t_frame:
+            t, i, j, count_i, count_j, wall = heappop(self.events)
+            if self.counts[i] != count_i:
+                continue
+            if j >= 0 and self.counts[j] != count_j:
+                continue
+            self.n_events += 1
+            self._collide(t, i, j, wall)
+
+        self.time_elapsed = t_frame
+        self.state = self._state_at(t_frame)
+
+
+if __name__ == '__main__':
+    #------------------------------------------------------------
+    # set up initial state
+    np.random.seed(0)
+    init_state = -0.5 + np.random.random((50, 4))
+    init_state[:, :2] *= 3.9
+
+    box = ParticleBox(init_state, size=0.04)
+    dt = 1. / 30 # 30fps
+
+
+    #------------------------------------------------------------
+    # set up figure and animation
+    fig = plt.figure()
+    fig.subplots_adjust(left=0, right=1, bottom=0, top=1)
+    ax = fig.add_subplot(111, aspect='equal', autoscale_on=False,
+                         xlim=(-3.2, 3.2), ylim=(-2.4, 2.4))
+
+    # particles holds the locations of the particles
+    particles, = ax.plot([], [], 'bo', ms=6)
+
+    # rect is the box edge
+    rect = plt.Rectangle(box.bounds[::2],
+                         box.bounds[1] - box.bounds[0],
+                         box.bounds[3] - box.bounds[2],
+                         ec='none', lw=2, fc='none')
+    ax.add_patch(rect)
+
+    def init():
+        """initialize animation"""
+        global box, rect
+        particles.set_data([], [])
+        rect.set_edgecolor('none')
+        return particles, rect
+
+    def animate(i):
+        """perform animation step"""
+        global box, rect, dt, ax, fig
+        box.step(dt)
+
+        ms = int(fig.dpi * 2 * box.size * fig.get_figwidth()
+                 / np.diff(ax.get_xbound())[0])
+
+        # update pieces of the animation
+        rect.set_edgecolor('k')
+        particles.set_data(box.state[:, 0], box.state[:, 1])
+        particles.set_markersize(ms)
+        return particles, rect
+
+    ani = animation.FuncAnimation(fig, animate, frames=600,
+                                  interval=10, blit=True, init_func=init)
+
+
+    # save the animation as an mp4.  This requires ffmpeg or mencoder to be
+    # installed.  The extra_args ensure that the x264 codec is used, so that
+    # the video can be embedded in html5.  You may need to adjust this for
+    # your system: for more information, see
+    # http://matplotlib.sourceforge.net/api/animation_api.html
+    #ani.save('particle_box.mp4', fps=30, extra_args=['-vcodec', 'libx264'])
+
+    plt.show()
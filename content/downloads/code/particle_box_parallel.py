@@ -0,0 +1,280 @@
+"""
+Parallel driver for ParticleBox
+
+The box is cut along x into one slab per worker process.  The particles
+are kept in shared memory, sorted so that the particles of each slab are
+a contiguous range of rows, and each worker moves, collides and reflects
+the particles of its own range.  Collisions between particles of
+neighbouring ranges are found by each worker from the ghost zone of its
+neighbour, within one collision range of its own particles, and resolved
+by the main process.
+"""
+import multiprocessing
+
+import numpy as np
+
+from particle_box import (NEIGHBOR_SEARCH, COLLISIONS, pairs_polydisperse,
+                          walls_and_gravity)
+
+
+#------------------------------------------------------------
+# Worker side: the shared buffers are attached once per process, and
+# each task works on a range [start, stop) of rows of one of the two
+# buffers.
+
+_shared = {}
+
+
+def _attach(state, M, R, index, N):
+    _shared['state'] = [np.frombuffer(s, dtype=float).reshape(N, 4)
+                        for s in state]
+    _shared['M'] = [np.frombuffer(m, dtype=float) for m in M]
+    _shared['R'] = [np.frombuffer(rad, dtype=float) for rad in R]
+    _shared['index'] = [np.frombuffer(i, dtype=np.int64) for i in index]
+
+
+def _slab_of(x, edges):
+    return np.clip(np.searchsorted(edges, x, side='right') - 1,
+                   0, len(edges) - 2)
+
+
+def _move(args):
+    """move the particles of a range, and return their extent in x"""
+    cur, start, stop, dt = args
+    state = _shared['state'][cur][start:stop]
+    state[:, :2] += dt * state[:, 2:]
+    if start == stop:
+        return np.inf, -np.inf
+    return state[:, 0].min(), state[:, 0].max()
+
+
+def _find_pairs(cur, rows, r, bounds, neighbors, polydisperse):
+    """the colliding pairs among the given rows of a buffer"""
+    X = _shared['state'][cur][rows, :2]
+    find_pairs = NEIGHBOR_SEARCH[neighbors]
+    if polydisperse:
+        return pairs_polydisperse(X, _shared['R'][cur][rows], bounds,
+                                  find_pairs)
+    return find_pairs(X, r, bounds)
+
+
+def _collide(args):
+    """
+    resolve the collisions within a range, and return the pairs between
+    the range and the ghost zones of its neighbours (as row indices)
+    """
+    (cur, start, stop, extent, neighbours, r, bounds,
+     neighbors, collisions, polydisperse) = args
+    if start == stop:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    state = _shared['state'][cur]
+    M = _shared['M'][cur]
+    slab_bounds = [extent[0], extent[1], bounds[2], bounds[3]]
+
+    ind1, ind2 = _find_pairs(cur, slice(start, stop), r, slab_bounds,
+                             neighbors, polydisperse)
+    COLLISIONS[collisions](state[start:stop], M[start:stop], ind1, ind2)
+
+    ghost1 = []
+    ghost2 = []
+    for lstart, lstop, lextent in neighbours:
+        # own particles near the neighbour, and its particles near ours
+        x = state[start:stop, 0]
+        near = start + np.where((x > lextent[0] - r) &
+                                (x < lextent[1] + r))[0]
+        x = state[lstart:lstop, 0]
+        ghosts = lstart + np.where((x > extent[0] - r) &
+                                   (x < extent[1] + r))[0]
+        if len(near) == 0 or len(ghosts) == 0:
+            continue
+
+        rows = np.concatenate([near, ghosts])
+        x = state[rows, 0]
+        ind1, ind2 = _find_pairs(cur, rows, r, [x.min(), x.max(),
+                                                bounds[2], bounds[3]],
+                                 neighbors, polydisperse)
+        cross = (ind1 < len(near)) & (ind2 >= len(near))
+        ghost1.append(rows[ind1[cross]])
+        ghost2.append(rows[ind2[cross]])
+
+    if ghost1:
+        return np.concatenate(ghost1), np.concatenate(ghost2)
+    return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+
+def _finish(args):
+    """
+    reflect the particles of a range at the walls and add gravity.
+    Return the number of them now lying in each slab.
+    """
+    cur, start, stop, bounds, G, dt, edges = args
+    state = _shared['state'][cur][start:stop]
+    walls_and_gravity(state, _shared['M'][cur][start:stop],
+                      _shared['R'][cur][start:stop], bounds, G, dt)
+
+    return np.bincount(_slab_of(state[:, 0], edges),
+                       minlength=len(edges) - 1)
+
+
+def _scatter(args):
+    """copy the particles of a range to their slabs in the other buffer"""
+    cur, start, stop, edges, offsets = args
+    state = _shared['state'][cur][start:stop]
+    slab = _slab_of(state[:, 0], edges)
+    order = np.argsort(slab, kind='mergesort')
+    slab = slab[order]
+
+    # rank of each particle among those of this range going to its slab
+    first = np.searchsorted(slab, slab, side='left')
+    dest = offsets[slab] + np.arange(len(slab)) - first
+
+    _shared['state'][1 - cur][dest] = state[order]
+    _shared['M'][1 - cur][dest] = _shared['M'][cur][start:stop][order]
+    _shared['R'][1 - cur][dest] = _shared['R'][cur][start:stop][order]
+    _shared['index'][1 - cur][dest] = _shared['index'][cur][start:stop][order]
+
+
+#------------------------------------------------------------
+# Main process
+
+class ParallelParticleBox:
+    """ParticleBox stepped by a pool of worker processes
+
+    init_state, bounds, size, M, G, neighbors and collisions are as for
+    ParticleBox.  workers is the number of processes (and of slabs), and
+    the particles are re-sorted into their slabs every sort_every steps.
+
+    The state and time_elapsed attributes are those of ParticleBox.
+    Reading state gathers the particles back into their original order.
+
+    A particle in contact with particles of two ranges has its
+    collisions within its own range resolved first.  ParticleBox
+    resolves them in the order of the particle indices.  The results
+    are only different for particles in several contacts at once.
+    """
+    def __init__(self,
+                 init_state = [[1, 0, 0, -1],
+                               [-0.5, 0.5, 0.5, 0.5],
+                               [-0.5, -0.5, -0.5, 0.5]],
+                 bounds = [-2, 2, -2, 2],
+                 size = 0.04,
+                 M = 0.05,
+                 G = 9.8,
+                 neighbors = 'cells',
+                 collisions = 'sequential',
+                 workers = None,
+                 sort_every = 10):
+        init_state = np.asarray(init_state, dtype=float)
+        N = init_state.shape[0]
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+
+        self.N = N
+        self.workers = workers
+        self.sort_every = sort_every
+        self.size = size
+        self.bounds = bounds
+        self.G = G
+        self.neighbors = neighbors
+        self.collisions = collisions
+        self.time_elapsed = 0
+        self.step_count = 0
+        self.edges = np.linspace(bounds[0], bounds[1], workers + 1)
+
+        # two copies of each buffer: re-sorting copies from one to the other
+        self._buffers = ([multiprocessing.RawArray('d', 4 * N)
+                          for i in range(2)],
+                         [multiprocessing.RawArray('d', N) for i in range(2)],
+                         [multiprocessing.RawArray('d', N) for i in range(2)],
+                         [multiprocessing.RawArray('q', N) for i in range(2)])
+        _attach(*(self._buffers + (N,)))
+        self._cur = 0
+        self._shared = dict(_shared)
+
+        self._shared['state'][0][:] = init_state
+        self._shared['M'][0][:] = M
+        self._shared['R'][0][:] = size
+        self._shared['index'][0][:] = np.arange(N)
+
+        self.pool = multiprocessing.Pool(workers, initializer=_attach,
+                                         initargs=self._buffers + (N,))
+
+        # the initial sort into slabs
+        slab = _slab_of(init_state[:, 0], self.edges)
+        self._sort(np.bincount(slab, minlength=workers)[None, :],
+                   [(0, N)])
+
+    @property
+    def state(self):
+        state = np.empty((self.N, 4))
+        state[self._shared['index'][self._cur]] = \
+            self._shared['state'][self._cur]
+        return state
+
+    @property
+    def M(self):
+        M = np.empty(self.N)
+        M[self._shared['index'][self._cur]] = self._shared['M'][self._cur]
+        return M
+
+    def _sort(self, counts, ranges):
+        """move the particles into their slabs, given the number of
+        particles of each range going to each slab"""
+        slab_start = np.concatenate([[0], np.cumsum(counts.sum(0))])
+        offsets = slab_start[:-1] + np.cumsum(counts, 0) - counts
+        self.pool.map(_scatter, [(self._cur, start, stop, self.edges,
+                                  offsets[k])
+                                 for k, (start, stop) in enumerate(ranges)])
+        self._cur = 1 - self._cur
+        self.ranges = list(zip(slab_start[:-1], slab_start[1:]))
+
+    def step(self, dt):
+        """step once by dt seconds"""
+        cur = self._cur
+        r = 2 * np.max(self.size)
+        self.time_elapsed += dt
+
+        # update positions
+        extents = self.pool.map(_move, [(cur, start, stop, dt)
+                                        for start, stop in self.ranges])
+
+        # each range collides its own pairs, and finds the pairs with
+        # the later ranges whose extents come within r of its own
+        tasks = []
+        for k, (start, stop) in enumerate(self.ranges):
+            neighbours = [self.ranges[l] + (extents[l],)
+                          for l in range(k + 1, len(self.ranges))
+                          if extents[l][0] - r < extents[k][1]
+                          and extents[l][1] + r > extents[k][0]]
+            tasks.append((cur, start, stop, extents[k], neighbours, r,
+                          self.bounds, self.neighbors, self.collisions,
+                          np.ndim(self.size) > 0))
+        ghost_pairs = self.pool.map(_collide, tasks)
+
+        # resolve the pairs across ranges on a copy of their particles
+        ind1 = np.concatenate([pair[0] for pair in ghost_pairs])
+        ind2 = np.concatenate([pair[1] for pair in ghost_pairs])
+        if len(ind1):
+            order = np.lexsort((ind2, ind1))
+            rows, pairs = np.unique(np.concatenate([ind1[order],
+                                                    ind2[order]]),
+                                    return_inverse=True)
+            state = self._shared['state'][cur]
+            local = state[rows]
+            COLLISIONS[self.collisions](local, self._shared['M'][cur][rows],
+                                        pairs[:len(ind1)], pairs[len(ind1):])
+            state[rows] = local
+
+        # check for crossing boundary, and add gravity
+        counts = self.pool.map(_finish, [(cur, start, stop, self.bounds,
+                                          self.G, dt, self.edges)
+                                         for start, stop in self.ranges])
+
+        self.step_count += 1
+        if self.step_count % self.sort_every == 0:
+            self._sort(np.array(counts), self.ranges)
+
+    def close(self):
+        """shut down the worker processes"""
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,115 @@
+"""
+Benchmark the batched double pendulum integrator
+
+Plots the time to simulate N double pendulums for one second against N,
+stepping one DoublePendulum object (and one odeint call) per pendulum
+per frame, and stepping all of them at once with derivs and rk4.
+
+Also compares the integrators of DoublePendulum over a long run: the
+number of evaluations of the equations of motion per simulated second,
+and the drift of the energy.  'midpoint' at h = 0.01 takes about as many
+evaluations as 'odeint' (about 940 against 1130 per second), at about
+1000 times its energy error; 'rk4_projected' takes about 210.
+"""
+from time import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+import scipy.integrate as integrate
+
+from double_pendulum import DoublePendulum, derivs, rk4
+
+
+def random_states(N, rseed=0):
+    """N initial states [theta1, omega1, theta2, omega2], in degrees"""
+    rng = np.random.RandomState(rseed)
+    init_state = np.zeros((N, 4))
+    init_state[:, ::2] = rng.uniform(-180, 180, (N, 2))
+    return init_state
+
+
+def time_odeint(N, T=1., dt=1. / 30):
+    times = []
+    for n in N:
+        pendulums = [DoublePendulum(s, method='odeint')
+                     for s in random_states(n)]
+        t0 = time()
+        for i in range(int(T / dt)):
+            for pendulum in pendulums:
+                pendulum.step(dt)
+        t1 = time()
+        times.append(t1 - t0)
+    return np.array(times)
+
+
+def time_rk4(N, T=1., dt=1. / 30, substeps=10):
+    times = []
+    for n in N:
+        state = random_states(n) * np.pi / 180.
+        t0 = time()
+        for i in range(int(T / dt)):
+            state = rk4(derivs, state, i * dt, dt / substeps, substeps)
+        t1 = time()
+        times.append(t1 - t0)
+    return np.array(times)
+
+
+def check_rk4(N=100, T=1., dt=1. / 30, substeps=10):
+    """print the largest difference from a tightly converged odeint"""
+    state = random_states(N) * np.pi / 180.
+    error = 0
+    for s in state:
+        exact = integrate.odeint(derivs, s, [0, T], rtol=1E-12, atol=1E-12)
+        error = max(error, abs(exact[1] - rk4(derivs, s, 0, dt / substeps,
+                                              int(T / dt) * substeps)).max())
+    print("rk4, h = %.4f: largest error after %.0fs = %.1e"
+          % (dt / substeps, T, error))
+
+
+def energy_drift(method, h=1. / 60, T=200., dt=1. / 30):
+    """run one pendulum for T seconds, and return its energy telemetry"""
+    pendulum = DoublePendulum([120., 0., -20., 0.], method=method, h=h)
+    for i in range(int(T / dt)):
+        pendulum.step(dt)
+    t, dE = pendulum.energy_drift()
+    print("%-14s %6.0f RHS/s  max |dE| = %.1e J"
+          % (method, pendulum.rhs_calls / T, abs(dE).max()))
+    return t, dE
+
+
+def plot_drift(ax, method, h=1. / 60):
+    t, dE = energy_drift(method, h)
+    ax.plot(t[1:], abs(dE[1:]) + 1E-16, label=method)
+
+
+if __name__ == '__main__':
+    check_rk4()
+
+    fig, ax = plt.subplots(subplot_kw=dict(yscale='log'))
+    plot_drift(ax, 'odeint')
+    plot_drift(ax, 'DOP853')
+    plot_drift(ax, 'midpoint', h=0.01)
+    plot_drift(ax, 'rk4_projected', h=1. / 30)
+    ax.legend(loc=4)
+    ax.set_xlabel('t (s)')
+    ax.set_ylabel('|energy change| (J)')
+    ax.set_title('Energy drift of DoublePendulum')
+    ax.grid(color='gray')
+
+    N = (10 ** np.arange(1, 6.01, 0.5)).astype(int)
+
+    fig, ax = plt.subplots(subplot_kw=dict(xscale='log', yscale='log'))
+
+    print("computing times for odeint...")
+    ax.plot(N[N <= 1000], time_odeint(N[N <= 1000]),
+            label='DoublePendulum.step (odeint)')
+    print("computing times for rk4...")
+    ax.plot(N, time_rk4(N), label='batched rk4')
+
+    ax.legend(loc=2)
+    ax.set_xlabel('N')
+    ax.set_ylabel('t (s) per simulated second')
+    ax.set_title('Double pendulum')
+    ax.grid(color='gray')
+
+    plt.show()
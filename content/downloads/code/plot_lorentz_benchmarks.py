@@ -0,0 +1,129 @@
+"""
+Benchmark the integration of bundles of Lorentz trajectories
+
+Plots the time to integrate N trajectories up to t = 4 against N, with
+one odeint call per trajectory as in earlier versions of
+lorentz_animation.py, and with one integrate_bundle call for all of them.
+
+Also plots the time to draw each frame of a long animation, re-slicing
+the whole history for every frame as in earlier versions, and with a
+TrailRenderer keeping the whole history or a fixed-length tail.
+"""
+from time import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy import integrate
+
+from lorentz_animation import lorentz_deriv, integrate_bundle, TrailRenderer
+
+
+def odeint_each(x0, t):
+    return np.asarray([integrate.odeint(lorentz_deriv, x0i, t)
+                       for x0i in x0])
+
+
+def time_integration(func, N, t, rseed=1):
+    times = []
+    for n in N:
+        rng = np.random.RandomState(rseed)
+        x0 = -15 + 30 * rng.random_sample((n, 3))
+        t0 = time()
+        func(x0, t)
+        t1 = time()
+        times.append(t1 - t0)
+    return np.array(times)
+
+
+def check_bundle(N=20, rseed=1):
+    """print the largest difference between the two methods at t = 1"""
+    rng = np.random.RandomState(rseed)
+    x0 = -15 + 30 * rng.random_sample((N, 3))
+    t = np.linspace(0, 1, 101)
+    print("largest difference at t = 1: %.1e"
+          % abs(odeint_each(x0, t) - integrate_bundle(x0, t)).max())
+
+
+def time_frames(x_t, tail=None, Nframes=10000, every=100):
+    """
+    Draw Nframes frames of the trajectories x_t, two time steps per
+    frame, and return the frame numbers and the time to draw every
+    every-th frame.  tail='slice' re-slices the history each frame.
+    """
+    fig = plt.figure()
+    ax = fig.add_axes([0, 0, 1, 1], projection='3d')
+    lines = sum([ax.plot([], [], [], '-') for xi in x_t], [])
+    pts = sum([ax.plot([], [], [], 'o') for xi in x_t], [])
+    ax.set_xlim((-25, 25))
+    ax.set_ylim((-35, 35))
+    ax.set_zlim((5, 55))
+    trails = TrailRenderer(lines, pts, None if tail == 'slice' else tail)
+
+    frames = np.arange(0, Nframes, every)
+    times = []
+    for i in range(Nframes):
+        t0 = time()
+        if tail == 'slice':
+            for line, pt, xi in zip(lines, pts, x_t):
+                x, y, z = xi[:2 * i].T
+                line.set_data(x, y)
+                line.set_3d_properties(z)
+                pt.set_data(x[-1:], y[-1:])
+                pt.set_3d_properties(z[-1:])
+        else:
+            trails.push(x_t[:, trails.n:2 * i])
+            trails.draw()
+        ax.view_init(30, 0.3 * i)
+        fig.canvas.draw()
+        t1 = time()
+        if i % every == 0:
+            times.append(t1 - t0)
+    plt.close(fig)
+    return frames, np.array(times)
+
+
+def plot_frames(ax, x_t, tail, label, Nframes=10000):
+    print("computing frame times for %s..." % label)
+    frames, times = time_frames(x_t, tail, Nframes)
+    ax.plot(frames, times, label=label)
+
+
+if __name__ == '__main__':
+    check_bundle()
+
+    Nframes = 10000
+    rng = np.random.RandomState(1)
+    x_t = integrate_bundle(-15 + 30 * rng.random_sample((20, 3)),
+                           np.linspace(0, 0.004 * Nframes, 2 * Nframes))
+
+    fig, ax = plt.subplots()
+    plot_frames(ax, x_t, 'slice', 're-sliced history', Nframes)
+    plot_frames(ax, x_t, None, 'TrailRenderer, whole history', Nframes)
+    plot_frames(ax, x_t, 200, 'TrailRenderer, tail = 200', Nframes)
+    ax.legend(loc=2)
+    ax.set_xlabel('frame')
+    ax.set_ylabel('t (s) per frame')
+    ax.set_title('Lorentz animation')
+    ax.grid(color='gray')
+
+    # fewer output times than the animation, to keep 10^5 trajectories
+    # in memory
+    t = np.linspace(0, 4, 101)
+    N = (10 ** np.arange(1, 5.01, 0.5)).astype(int)
+
+    fig, ax = plt.subplots(subplot_kw=dict(xscale='log', yscale='log'))
+
+    print("computing times for odeint...")
+    ax.plot(N[N <= 10 ** 4], time_integration(odeint_each, N[N <= 10 ** 4], t),
+            label='odeint per trajectory')
+    print("computing times for integrate_bundle...")
+    ax.plot(N, time_integration(integrate_bundle, N, t),
+            label='integrate_bundle')
+
+    ax.legend(loc=2)
+    ax.set_xlabel('N')
+    ax.set_ylabel('t (s)')
+    ax.set_title('Lorentz trajectories')
+    ax.grid(color='gray')
+
+    plt.show()
@@ -0,0 +1,184 @@
+"""
+Benchmark the neighbour searches used by ParticleBox.step
+
+Plots the time per step against the number of particles N, for boxes
+whose size grows with N so that the density of particles stays fixed.
+Also checks the vectorized collision responses against the plain loop,
+compares the event-driven engine with fixed steps for a dilute gas, and
+times an ensemble of boxes stepped together against a loop over boxes,
+and the neighbour search for a mixture of small and large particles.
+"""
+from time import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from particle_box import (ParticleBox, ParticleBoxEnsemble, EventDrivenBox,
+                          COLLISIONS, pairs_cells, pairs_polydisperse)
+
+
+def random_box(N, neighbors, density=3., size=0.04, rseed=0):
+    """create a box of N particles at the given number density"""
+    rng = np.random.RandomState(rseed)
+    L = np.sqrt(N / density)
+    init_state = -0.5 + rng.rand(N, 4)
+    init_state[:, :2] *= L
+    return ParticleBox(init_state, bounds=[-L / 2, L / 2, -L / 2, L / 2],
+                       size=size, neighbors=neighbors)
+
+
+def time_step(N, neighbors, dt=1. / 30, bestof=3):
+    times = []
+    for n in N:
+        box = random_box(n, neighbors)
+        t_best = np.inf
+        for i in range(bestof):
+            t0 = time()
+            box.step(dt)
+            t1 = time()
+            t_best = min(t_best, t1 - t0)
+        times.append(t_best)
+    return np.array(times)
+
+
+def check_collisions(N=2000, r=0.02, rseed=0):
+    """
+    Compare the collision responses on one set of random, overlapping
+    particles: print the time taken and the change of the total momentum
+    and kinetic energy, which should both be zero.
+    """
+    rng = np.random.RandomState(rseed)
+    state = rng.rand(N, 4)
+    M = rng.uniform(0.5, 2, N)
+    ind1, ind2 = pairs_cells(state[:, :2], r, [0, 1, 0, 1])
+    print("%i particles, %i colliding pairs" % (N, len(ind1)))
+
+    def momentum(state):
+        return (M[:, None] * state[:, 2:]).sum(0)
+
+    def energy(state):
+        return 0.5 * (M * (state[:, 2:] ** 2).sum(1)).sum()
+
+    for name in sorted(COLLISIONS):
+        s = state.copy()
+        t0 = time()
+        COLLISIONS[name](s, M, ind1, ind2)
+        t1 = time()
+        print("  %-12s t = %.4fs  |dP| = %.1e  dE/E = %.1e"
+              % (name, t1 - t0, abs(momentum(s) - momentum(state)).max(),
+                 energy(s) / energy(state) - 1))
+
+
+def check_event_driven(N=1000, density=0.3, size=0.01, T=10., rseed=0):
+    """
+    Simulate T seconds of a dilute gas with the event-driven engine at
+    30 frames per second, and with fixed steps of size / vmax, the
+    largest which cannot step over a collision.  Print the time taken
+    and the number of collisions or steps of each.
+    """
+    rng = np.random.RandomState(rseed)
+    L = np.sqrt(N / density)
+    init_state = -0.5 + rng.rand(N, 4)
+    init_state[:, :2] *= L
+    bounds = [-L / 2, L / 2, -L / 2, L / 2]
+
+    box = EventDrivenBox(init_state, bounds=bounds, size=size, G=0)
+    t0 = time()
+    for i in range(int(30 * T)):
+        box.step(1. / 30)
+    t1 = time()
+    print("event-driven: t = %.2fs  %i collisions" % (t1 - t0, box.n_events))
+
+    box = ParticleBox(init_state, bounds=bounds, size=size, G=0)
+    dt = size / abs(init_state[:, 2:]).max()
+    t0 = time()
+    for i in range(int(T / dt)):
+        box.step(dt)
+    t1 = time()
+    print("fixed steps:  t = %.2fs  %i steps" % (t1 - t0, int(T / dt)))
+
+
+def check_ensemble(E=300, N=50, Nsteps=30, rseed=0):
+    """
+    Step E boxes of N particles, with different sizes and gravities,
+    one box at a time and as a ParticleBoxEnsemble.  Print the time
+    taken by each and the largest difference of the final states.
+    """
+    rng = np.random.RandomState(rseed)
+    init_state = -0.5 + rng.rand(E, N, 4)
+    init_state[:, :, :2] *= 3.9
+    size = rng.uniform(0.02, 0.06, E)
+    G = rng.uniform(0, 20, E)
+
+    boxes = [ParticleBox(init_state[e], size=size[e], G=G[e])
+             for e in range(E)]
+    t0 = time()
+    for box in boxes:
+        for i in range(Nsteps):
+            box.step(1. / 30)
+    t1 = time()
+    print("%i boxes: t = %.2fs" % (E, t1 - t0))
+
+    ensemble = ParticleBoxEnsemble(init_state, size=size, G=G)
+    t0 = time()
+    ensemble.run(1. / 30, Nsteps)
+    t1 = time()
+    print("ensemble:  t = %.2fs  max difference = %.1e"
+          % (t1 - t0, abs(ensemble.state -
+                          np.array([box.state for box in boxes])).max()))
+
+
+def check_polydisperse(N=100000, density=3., fraction=0.01, rseed=0):
+    """
+    Find the touching pairs in a mixture of particles of radius 0.02 and
+    a fraction of particles of radius 0.5, with pairs_polydisperse and
+    with a cell list at the range of the largest particles.
+    """
+    rng = np.random.RandomState(rseed)
+    L = np.sqrt(N / density)
+    X = L * (rng.rand(N, 2) - 0.5)
+    R = np.where(rng.rand(N) < fraction, 0.5, 0.02)
+    bounds = [-L / 2, L / 2, -L / 2, L / 2]
+
+    t0 = time()
+    ind1, ind2 = pairs_polydisperse(X, R, bounds)
+    t1 = time()
+    print("polydisperse:  t = %.2fs  %i pairs" % (t1 - t0, len(ind1)))
+
+    t0 = time()
+    ind1, ind2 = pairs_cells(X, 2 * R.max(), bounds)
+    D = np.sqrt(((X[ind1] - X[ind2]) ** 2).sum(1))
+    touching = (D < R[ind1] + R[ind2])
+    t1 = time()
+    print("largest range: t = %.2fs  %i pairs" % (t1 - t0, touching.sum()))
+
+
+def plot_neighbors(ax, N, neighbors):
+    print("computing step times for %s..." % neighbors)
+    t = time_step(N, neighbors)
+    ax.plot(N, t, label=neighbors)
+
+
+if __name__ == '__main__':
+    check_collisions()
+    check_event_driven()
+    check_ensemble()
+    check_polydisperse()
+
+    N = (10 ** np.arange(2, 6.01, 0.5)).astype(int)
+
+    fig, ax = plt.subplots(subplot_kw=dict(xscale='log', yscale='log'))
+
+    # the full distance matrix does not fit in memory beyond ~10^4.5
+    plot_neighbors(ax, N[N <= 10 ** 4], 'pdist')
+    plot_neighbors(ax, N, 'kdtree')
+    plot_neighbors(ax, N, 'cells')
+    ax.plot(N, 1E-6 * N, ':k', label='linear')
+
+    ax.legend(loc=2)
+    ax.set_xlabel('N')
+    ax.set_ylabel('t (s)')
+    ax.set_title('ParticleBox.step')
+    ax.grid(color='gray')
+
+    plt.show()
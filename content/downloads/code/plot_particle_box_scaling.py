@@ -0,0 +1,72 @@
+"""
+Scaling of the parallel ParticleBox driver
+
+Plots the number of steps per second of ParallelParticleBox against the
+number of worker processes, for 10 ** 7 particles at a fixed density,
+together with ParticleBox.step on a single core.
+"""
+from multiprocessing import cpu_count
+from time import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from particle_box import ParticleBox
+from particle_box_parallel import ParallelParticleBox
+
+
+def random_state(N, density=3., rseed=0):
+    """return the initial state and bounds of N particles"""
+    rng = np.random.RandomState(rseed)
+    L = np.sqrt(N / density)
+    init_state = -0.5 + rng.rand(N, 4)
+    init_state[:, :2] *= L
+    return init_state, [-L / 2, L / 2, -L / 2, L / 2]
+
+
+def time_steps(box, Nsteps=5, dt=1. / 30):
+    """return the number of steps per second, after a first step"""
+    box.step(dt)
+    t0 = time()
+    for i in range(Nsteps):
+        box.step(dt)
+    t1 = time()
+    return Nsteps / (t1 - t0)
+
+
+def scaling(N, workers):
+    init_state, bounds = random_state(N)
+    rates = []
+    for w in workers:
+        print("timing %i workers..." % w)
+        box = ParallelParticleBox(init_state, bounds, size=0.04, workers=w)
+        rates.append(time_steps(box))
+        box.close()
+    return np.array(rates)
+
+
+if __name__ == '__main__':
+    N = 10 ** 7
+    workers = 2 ** np.arange(int(np.log2(cpu_count())) + 1)
+
+    init_state, bounds = random_state(N)
+    print("timing ParticleBox...")
+    serial = time_steps(ParticleBox(init_state, bounds, size=0.04))
+    rates = scaling(N, workers)
+
+    print("\n%8s %12s %8s" % ("workers", "steps/sec", "speedup"))
+    for w, rate in zip(workers, rates):
+        print("%8i %12.3f %8.2f" % (w, rate, rate / serial))
+
+    fig, ax = plt.subplots(subplot_kw=dict(xscale='log', yscale='log'))
+    ax.plot(workers, rates, 'o-', label='ParallelParticleBox')
+    ax.plot(workers, serial * workers, ':k', label='linear')
+    ax.axhline(serial, color='gray', ls='--', label='ParticleBox')
+
+    ax.legend(loc=2)
+    ax.set_xlabel('workers')
+    ax.set_ylabel('steps per second')
+    ax.set_title('ParticleBox, N = %.0e' % N)
+    ax.grid(color='gray')
+
+    plt.show()
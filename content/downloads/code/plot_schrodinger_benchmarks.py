@@ -0,0 +1,67 @@
+"""
+Benchmark the FFT engines used by Schrodinger.time_step
+
+Plots the number of split-step time steps per second against the grid
+size N, for N between 2 ** 10 and 2 ** 22.
+"""
+from multiprocessing import cpu_count
+from time import time
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from schrodinger import Schrodinger, FFTEngine, FFTWEngine, gauss_x
+
+
+def time_steps(fft_engine, N, Nsteps=20, bestof=3, dt=0.01):
+    """return the number of time steps per second for each grid size N"""
+    rates = []
+    for n in N:
+        x = 0.1 * (np.arange(n) - 0.5 * n)
+        S = Schrodinger(x, gauss_x(x, 2.0, 0.0, 1.0), np.zeros(n),
+                        fft_engine=fft_engine)
+
+        # the first call sets up the evolution operators and FFT plans
+        S.time_step(dt, 1)
+
+        t_best = np.inf
+        for i in range(bestof):
+            t0 = time()
+            S.time_step(dt, Nsteps)
+            t1 = time()
+            t_best = min(t_best, t1 - t0)
+
+        rates.append(Nsteps / t_best)
+
+    return np.array(rates)
+
+
+def plot_engine(ax, N, fft_engine, label):
+    print("computing steps per second for %s..." % label)
+    rate = time_steps(fft_engine, N)
+    ax.plot(N, rate, label=label)
+
+
+if __name__ == '__main__':
+    N = 2 ** np.arange(10, 23)
+    workers = cpu_count()
+
+    fig, ax = plt.subplots(subplot_kw=dict(xscale='log', yscale='log'))
+
+    plot_engine(ax, N, FFTEngine(workers=1), 'scipy.fft (1 worker)')
+
+    try:
+        plot_engine(ax, N, FFTWEngine(workers=1), 'FFTW (1 thread)')
+        if workers > 1:
+            plot_engine(ax, N, FFTWEngine(workers=workers),
+                        'FFTW (%i threads)' % workers)
+    except ImportError:
+        print("pyFFTW cannot be loaded")
+
+    ax.legend(loc=1)
+    ax.set_xlabel('N')
+    ax.set_ylabel('time steps per second')
+    ax.set_title('Split-step Schrodinger solver')
+    ax.grid(color='gray')
+
+    plt.show()
@@ -8,10 +8,106 @@ license: BSD
 Please feel free to use and modify this, but keep the above information. Thanks!
 """
 
+from collections import OrderedDict
+from itertools import count
+
 import numpy as np
 from matplotlib import pyplot as pl
 from matplotlib import animation
-from scipy.fftpack import fft,ifft
+from scipy.fftpack import fftn, ifftn
+
+from npy_stream import NpyStreamWriter
+
+try:
+    # scipy 1.4+ : pocketfft with plan caching and multithreading
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+
+class FFTEngine(object):
+    """
+    Computes FFTs along the last axes of an array, in place.
+
+    The default engine uses scipy.fft, which caches its plans between
+    calls.  Note that scipy.fft only spreads independent transforms over
+    `workers` threads, so multiple workers help for ensembles of wave
+    functions but not for a single one-dimensional transform.
+    """
+    def __init__(self, workers=1):
+        self.workers = workers
+
+    def empty(self, shape, dtype=complex):
+        """allocate a complex work buffer suitable for this engine"""
+        return np.empty(shape, dtype=dtype)
+
+    def _transform(self, func, a, axes):
+        if scipy_fft is None:
+            out = func(a, axes=axes, overwrite_x=True)
+        else:
+            out = func(a, axes=axes, overwrite_x=True, workers=self.workers)
+        # overwrite_x is only a hint, so copy back if a new array came out
+        if not np.may_share_memory(out, a):
+            a[...] = out
+        return a
+
+    def fft(self, a, axes=(-1,)):
+        return self._transform(fftn if scipy_fft is None
+                               else scipy_fft.fftn, a, axes)
+
+    def ifft(self, a, axes=(-1,)):
+        return self._transform(ifftn if scipy_fft is None
+                               else scipy_fft.ifftn, a, axes)
+
+
+class FFTWEngine(FFTEngine):
+    """
+    Computes FFTs along the last axes of an array, in place, using FFTW.
+
+    Requires pyFFTW.  One plan is built per array shape and type, and
+    reused for every later call.  Unlike scipy.fft, FFTW uses all `workers` threads
+    even for a single one-dimensional transform, which pays off for very
+    large grids.
+    """
+    def __init__(self, workers=1, planner_effort='FFTW_MEASURE'):
+        import pyfftw
+        self.pyfftw = pyfftw
+        self.workers = workers
+        self.planner_effort = planner_effort
+        self.plans = {}
+
+    def empty(self, shape, dtype=complex):
+        return self.pyfftw.empty_aligned(shape, dtype=dtype)
+
+    def _plan(self, a, axes, direction):
+        key = (a.shape, a.dtype, tuple(axes), direction)
+        if key not in self.plans:
+            # planning may overwrite the buffer, so plan on a scratch copy
+            buf = self.empty(a.shape, a.dtype)
+            self.plans[key] = self.pyfftw.FFTW(buf, buf, axes=axes,
+                                               direction=direction,
+                                               flags=(self.planner_effort,),
+                                               threads=self.workers)
+        return self.plans[key]
+
+    def fft(self, a, axes=(-1,)):
+        self._plan(a, axes, 'FFTW_FORWARD')(a, a)
+        return a
+
+    def ifft(self, a, axes=(-1,)):
+        self._plan(a, axes, 'FFTW_BACKWARD')(a, a)
+        return a
+
+
+# Weights of the second-order (Strang) steps which are composed into a
+# split-operator step of the given order.  4: Yoshida's triple jump;
+# 6: Yoshida's seven-stage solution A (Phys. Lett. A 150, 262 (1990)).
+_cbrt2 = 2 ** (1. / 3)
+_w6 = [0.784513610477560, 0.235573213359357, -1.17767998417887]
+SPLITTING_WEIGHTS = {2: [1.0],
+                     4: [1. / (2 - _cbrt2), -_cbrt2 / (2 - _cbrt2),
+                         1. / (2 - _cbrt2)],
+                     6: _w6 + [1 - 2 * sum(_w6)] + _w6[::-1]}
 
 
 class Schrodinger(object):
@@ -20,16 +116,27 @@ class Schrodinger(object):
     Schrodinger equation for an arbitrary potential
     """
     def __init__(self, x, psi_x0, V_x,
-                 k0 = None, hbar=1, m=1, t0=0.0):
+                 k0 = None, hbar=1, m=1, t0=0.0,
+                 fft_engine=None, workers=1, order=2, V_period=None,
+                 cache_size=None, max_memory=2 ** 30):
         """
         Parameters
         ----------
         x : array_like, float
             length-N array of evenly spaced spatial coordinates
         psi_x0 : array_like, complex
-            length-N array of the initial wave function at time t0
+            length-N array of the initial wave function at time t0.
+            Alternatively, an [M x N] array holding an ensemble of M
+            initial wave functions, which are evolved together.
         V_x : array_like, float
-             length-N array giving the potential at each x
+             length-N array giving the potential at each x.
+             Alternatively, an [M x N] array giving a separate potential
+             for each member of the ensemble.  V_x may also depend on
+             time, given either as a function V(x, t) returning such an
+             array, or as a schedule [(t1, V1), (t2, V2), ...] of
+             potentials which apply from t1, t2, ... onwards.  Within a
+             time step, each sub-step in x uses the potential at its own
+             time, so that the integrator keeps its order.
         k0 : float
             the minimum value of k.  Note that, because of the workings of the
             fast fourier transform, the momentum wave-number will be defined
@@ -44,21 +151,51 @@ class Schrodinger(object):
             particle mass (default = 1)
         t0 : float
             initial tile (default = 0)
+        fft_engine : FFTEngine, optional
+            the engine used to compute the FFTs.  If not specified, an
+            FFTEngine with the given number of workers is used.
+        workers : int
+            number of threads used by the default FFT engine (default = 1)
+        order : int
+            order of the split-operator integrator: 2 (Strang splitting),
+            4 or 6 (Yoshida compositions).  Default = 2
+        V_period : float, optional
+            if V_x is a function which is periodic in time, its period.
+            The evolution operators are then reused from one period to
+            the next.
+        cache_size : int, optional
+            the maximum number of evolution operators kept for reuse.
+            If not specified, 24.  If V_period is a whole number of time
+            steps, the cache grows to hold the operators of one period,
+            as far as they fit in max_memory.
+        max_memory : int
+            the number of bytes which psi, the potential and the cached
+            evolution operators may use together when the cache grows to
+            hold a period of V_x (default = 1 GB)
         """
         # Validation of array inputs
-        self.x, psi_x0, self.V_x = map(np.asarray, (x, psi_x0, V_x))
+        self.x, psi_x0 = map(np.asarray, (x, psi_x0))
+        self.t = t0
+        self.V_dtype = np.dtype(float)
+        self.V_period = V_period
+        self.V_x = V_x
         N = self.x.size
         assert self.x.shape == (N,)
-        assert psi_x0.shape == (N,)
-        assert self.V_x.shape == (N,)
+        assert psi_x0.ndim in (1, 2) and psi_x0.shape[-1] == N
+        assert self.V_x.ndim in (1, 2) and self.V_x.shape[-1] == N
+
+        # ensemble members lie along the first axis: a single potential is
+        # shared by all wave functions, and a single wave function is
+        # copied for each potential.
+        self.shape = np.broadcast(psi_x0, self.V_x).shape
+        psi_x0 = psi_x0 + np.zeros(self.shape, dtype=complex)
 
         # Set internal parameters
-        self.hbar = hbar
-        self.m = m
-        self.t = t0
-        self.dt_ = None
+        self.dtype = np.dtype(complex)
+        self.axes = (-1,)
         self.N = len(x)
         self.dx = self.x[1] - self.x[0]
+        self.dV = self.dx
         self.dk = 2 * np.pi / (self.N * self.dx)
 
         # set momentum scale
@@ -67,14 +204,57 @@ class Schrodinger(object):
         else:
             self.k0 = k0
         self.k = self.k0 + self.dk * np.arange(self.N)
+        self.max_cache_ops_ = self._cache_budget(max_memory)
 
+        # phase factors relating psi_x/psi_k to their discretized forms.
+        # These depend only on the grid, so are computed once here.
+        self.x_phase = (np.exp(1j * self.k[0] * self.x)
+                        * np.sqrt(2 * np.pi) / self.dx)
+        self.k_phase = np.exp(-1j * self.x[0] * self.dk * np.arange(self.N))
+
+        self._init_state(psi_x0, hbar, m, fft_engine, workers, order,
+                         cache_size)
+
+    def _init_state(self, psi_x0, hbar, m, fft_engine, workers, order,
+                    cache_size):
+        """set up the parameters and storage shared by all grid types"""
+        self.hbar = hbar
+        self.m = m
+        self.dt_ = None
+        self.order_ = None
+        self.order = order
+        self.dt_adapt_ = None
+
+        # psi is stored in whichever space was last written; the other
+        # representation is computed only when it is read.  Both live in
+        # preallocated buffers which the FFT engine transforms in place.
+        if fft_engine is None:
+            fft_engine = FFTEngine(workers=workers)
+        self.fft_engine = fft_engine
+        self.psi_mod_x_ = fft_engine.empty(self.shape, self.dtype)
+        self.psi_mod_k_ = fft_engine.empty(self.shape, self.dtype)
+        self.x_current_ = False
+        self.k_current_ = False
         self.psi_x = psi_x0
-        self.compute_k_from_x()
 
         # variables which hold steps in evolution of the
         self.x_evolve_half = None
         self.x_evolve = None
         self.k_evolve = None
+        self.x_evolve_ops = None
+        self.k_evolve_ops = None
+        self.evolve_cache_ = OrderedDict()
+        self.cache_size_ = cache_size
+        self.default_cache_size_ = self.evolve_cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # imaginary part -W(x) of the potential in absorbing layers
+        self.absorber = 0
+
+        # objects called every few time steps, e.g. to record snapshots
+        self.step_count = 0
+        self.monitors = []
 
         # attributes used for dynamic plotting
         self.psi_x_line = None
@@ -82,47 +262,316 @@ class Schrodinger(object):
         self.V_x_line = None
 
     def _set_psi_x(self, psi_x):
-        self.psi_mod_x = (psi_x * np.exp(-1j * self.k[0] * self.x)
-                          * self.dx / np.sqrt(2 * np.pi))
+        self.psi_mod_x = psi_x / self.x_phase
 
     def _get_psi_x(self):
-        return (self.psi_mod_x * np.exp(1j * self.k[0] * self.x)
-                * np.sqrt(2 * np.pi) / self.dx)
+        return self.psi_mod_x * self.x_phase
 
     def _set_psi_k(self, psi_k):
-        self.psi_mod_k = psi_k * np.exp(1j * self.x[0]
-                                        * self.dk * np.arange(self.N))
+        self.psi_mod_k = psi_k / self.k_phase
 
     def _get_psi_k(self):
-        return self.psi_mod_k * np.exp(-1j * self.x[0] * 
-                                        self.dk * np.arange(self.N))
+        return self.psi_mod_k * self.k_phase
+
+    def _set_psi_mod_x(self, psi_mod_x):
+        if psi_mod_x is not self.psi_mod_x_:
+            self.psi_mod_x_[...] = psi_mod_x
+        self.x_current_ = True
+        self.k_current_ = False
+
+    def _get_psi_mod_x(self):
+        if not self.x_current_:
+            self.compute_x_from_k()
+        return self.psi_mod_x_
+
+    def _set_psi_mod_k(self, psi_mod_k):
+        if psi_mod_k is not self.psi_mod_k_:
+            self.psi_mod_k_[...] = psi_mod_k
+        self.k_current_ = True
+        self.x_current_ = False
+
+    def _get_psi_mod_k(self):
+        if not self.k_current_:
+            self.compute_k_from_x()
+        return self.psi_mod_k_
     
     def _get_dt(self):
         return self.dt_
 
+    def _set_V_x(self, V_x):
+        self.V_func_ = None
+        self.V_schedule_ = None
+        if callable(V_x):
+            self.V_func_ = V_x
+        elif _is_schedule(V_x):
+            self.V_times_ = np.array([t for (t, V) in V_x])
+            self.V_schedule_ = [np.asarray(V, dtype=self.V_dtype)
+                                for (t, V) in V_x]
+        else:
+            self.V_x_ = np.asarray(V_x, dtype=self.V_dtype)
+
+        # each new potential gets its own id in the operator cache
+        self.V_id_ = next(_potential_ids)
+        self.V_key_ = None
+        self.V_x_key_ = None
+        self._update_potential(self.t)
+        self.dt_ = None
+
+    def _get_V_x(self):
+        if self.V_x_key_ != self.V_key_:
+            if self.V_schedule_ is not None:
+                self.V_x_ = self.V_schedule_[self.V_key_]
+            else:
+                self.V_x_ = np.asarray(self.V_func_(self.x, self.V_t_),
+                                       dtype=self.V_dtype)
+            self.V_x_key_ = self.V_key_
+        return self.V_x_
+
+    def potential_at(self, t):
+        """the potential at time t"""
+        self._update_potential(t)
+        return self.V_x
+
+    def _update_potential(self, t):
+        """Select the potential at time t.  Returns True if it changed."""
+        if self.V_schedule_ is not None:
+            key = max(np.searchsorted(self.V_times_, t, side='right') - 1, 0)
+        elif self.V_func_ is not None:
+            if self.V_period is not None:
+                # round the phase, so that equal phases share one key
+                t = round((t % self.V_period) / self.V_period, 9)
+                t *= self.V_period
+            key = t
+        else:
+            return False
+
+        if key == self.V_key_:
+            return False
+        self.V_key_ = key
+        self.V_t_ = t
+        return True
+
     def _set_dt(self, dt):
         if dt != self.dt_:
             self.dt_ = dt
-            self.x_evolve_half = np.exp(-0.5 * 1j * self.V_x
-                                         / self.hbar * dt )
-            self.x_evolve = self.x_evolve_half * self.x_evolve_half
-            self.k_evolve = np.exp(-0.5 * 1j * self.hbar /
-                                    self.m * (self.k * self.k) * dt)
-    
+            self._update_evolve_ops()
+
+    def _time_dependent(self):
+        return self.V_func_ is not None or self.V_schedule_ is not None
+
+    def _update_evolve_ops(self):
+        """build the operators for the current dt and potential"""
+        dt = self.dt_
+        # The order-p step is a composition of Strang steps with the
+        # given weights.  Neighbouring half-steps in x are merged, so
+        # x_coeffs_ holds the steps in x between successive k steps,
+        # followed by the last half-step and the merged half-steps
+        # between one full step and the next.
+        w = SPLITTING_WEIGHTS[self.order]
+        self.x_coeffs_ = ([0.5 * w[0]]
+                          + [0.5 * (w1 + w2) for w1, w2 in zip(w[:-1], w[1:])]
+                          + [0.5 * w[-1], 0.5 * (w[-1] + w[0])])
+
+        # A time-dependent potential is handled as if time only advanced
+        # during the k steps, which keeps the order of the composition:
+        # each step in x uses the potential at the time reached by the k
+        # steps before it, given here as a fraction of dt.
+        self.x_times_ = list(np.cumsum([0] + w[:-1])) + [1., 1.]
+
+        self._resize_cache()
+        self.k_evolve_ops = [self._k_evolve(c * dt) for c in w]
+        if self._time_dependent():
+            # the operators in x are built as they are needed
+            self.x_evolve_ops = None
+        else:
+            self.x_evolve_ops = [self._x_evolve(c * dt)
+                                 for c in self.x_coeffs_]
+
+        if self.order == 2 and self.x_evolve_ops is not None:
+            self.x_evolve_half = self.x_evolve_ops[0]
+            self.x_evolve = self.x_evolve_ops[-1]
+            self.k_evolve = self.k_evolve_ops[0]
+        else:
+            self.x_evolve_half = self.x_evolve = self.k_evolve = None
+
+    def _get_order(self):
+        return self.order_
+
+    @staticmethod
+    def _check_order(order):
+        if order not in SPLITTING_WEIGHTS:
+            raise ValueError("order must be one of %s"
+                             % sorted(SPLITTING_WEIGHTS.keys()))
+
+    def _set_order(self, order):
+        self._check_order(order)
+        if order != self.order_:
+            self.order_ = order
+            self.dt_ = None
+
+    # default maximum number of evolution operators kept in evolve_cache_
+    evolve_cache_size = 24
+
+    def _resize_cache(self):
+        """set the size of the operator cache for the current dt"""
+        size = self.cache_size_
+        if size is None:
+            size = self.default_cache_size_
+            steps = (round(self.V_period / abs(self.dt_), 6)
+                     if self.V_period is not None else 0.5)
+            if self._time_dependent() and steps == int(steps):
+                # the operators repeat every period, so make room for
+                # those of one period, within the memory budget
+                n_period = (len(self.x_coeffs_) * int(steps)
+                            + len(SPLITTING_WEIGHTS[self.order]))
+                size = max(size, min(n_period, self.max_cache_ops_))
+        self.evolve_cache_size = size
+
+    # number of grids besides the operator cache counted in the budget
+    n_fixed_grids = 8
+
+    def _cache_budget(self, max_memory):
+        """the number of operators which fit in max_memory"""
+        # psi_x, psi_k, the two phase factors, the two buffers of evolve()
+        # and the temporary used while an operator is built are complex
+        # grids; the potential and the absorbing layers are real grids.
+        # The rest goes to the operator cache.
+        grid_bytes = self.dtype.itemsize * np.prod(self.shape)
+        return int(max_memory // grid_bytes - self.n_fixed_grids)
+
+    def _cached_evolve(self, key, compute):
+        # Sub-steps of equal length share one operator array, whichever
+        # order or dt they come from.  The least recently used operator
+        # is dropped when the cache is full.
+        cache = self.evolve_cache_
+        if key in cache:
+            self.cache_hits += 1
+            op = cache.pop(key)
+        else:
+            self.cache_misses += 1
+            while cache and len(cache) >= self.evolve_cache_size:
+                cache.popitem(last=False)
+            op = compute()
+        cache[key] = op
+        return op
+
+    def _x_op(self, j, t0, i):
+        """the j-th operator in x of the i-th step after time t0"""
+        if self.x_evolve_ops is not None:
+            return self.x_evolve_ops[j]
+        self._update_potential(t0 + (i + self.x_times_[j]) * self.dt_)
+        return self._x_evolve(self.x_coeffs_[j] * self.dt_)
+
+    def _x_evolve(self, tau):
+        return self._cached_evolve(
+            ('x', self.V_id_, self.V_key_, tau),
+            lambda: np.exp((-1j * self.V_x - self.absorber) / self.hbar
+                           * tau).astype(self.dtype, copy=False))
+
+    def _k_evolve(self, tau):
+        return self._cached_evolve(
+            ('k', tau), lambda: np.exp(-0.5 * 1j * self.hbar / self.m
+                                       * (self.k * self.k) * tau))
+
     psi_x = property(_get_psi_x, _set_psi_x)
     psi_k = property(_get_psi_k, _set_psi_k)
+    psi_mod_x = property(_get_psi_mod_x, _set_psi_mod_x)
+    psi_mod_k = property(_get_psi_mod_k, _set_psi_mod_k)
     dt = property(_get_dt, _set_dt)
+    order = property(_get_order, _set_order)
+    V_x = property(_get_V_x, _set_V_x)
 
     def compute_k_from_x(self):
-        self.psi_mod_k = fft(self.psi_mod_x)
+        # the transform is along the last axis, so an ensemble of
+        # wave functions is handled in a single call
+        self.psi_mod_k_[...] = self.psi_mod_x
+        self.fft_engine.fft(self.psi_mod_k_, self.axes)
+        self.k_current_ = True
 
     def compute_x_from_k(self):
-        self.psi_mod_x = ifft(self.psi_mod_k)
+        self.psi_mod_x_[...] = self.psi_mod_k
+        self.fft_engine.ifft(self.psi_mod_x_, self.axes)
+        self.x_current_ = True
+
+    def add_absorbing_boundary(self, width=None, strength=None,
+                               reflection=1E-3, power=2):
+        """
+        Add absorbing layers at the edges of the grid.
+
+        Within each layer, a complex absorbing potential -i W(x) with
+        W = strength * (s / width) ** power is added to V(x), where s is
+        the depth into the layer.  Outgoing waves are then absorbed
+        rather than reflected by walls or wrapped around the periodic
+        grid, so the grid only needs to hold the region of interest.
+        Absorbed probability shows up as a decrease of the norm.
+
+        Parameters
+        ----------
+        width : float, optional
+            width of the layer.  If not specified, it is set to the
+            longest de Broglie wavelength in the current wave function,
+            which keeps reflections off the layer itself small, but to
+            at most a quarter of the grid.
+        strength : float, optional
+            the maximum of W.  If not specified, it is chosen so that the
+            fastest component of the current wave function is attenuated
+            to the given reflection amplitude on its way in and out.
+        reflection : float
+            target amplitude of waves returning from the layer
+        power : float
+            power of the absorbing profile (default = 2)
+        """
+        xs = self.x if isinstance(self.x, list) else [self.x]
+        ks = self.k if isinstance(self.k, list) else [self.k]
+        ndim = len(xs)
+
+        # probability along each k axis, summed over everything else
+        density_k = abs(self.psi_mod_k) ** 2
+        all_axes = tuple(range(density_k.ndim))
+
+        self.absorber = 0
+        for d, (x, k) in enumerate(zip(xs, ks)):
+            axis = density_k.ndim - ndim + d
+            p_k = density_k.sum(axis=tuple(a for a in all_axes
+                                           if a != axis))
+
+            # range of |k| holding all but the tails of the probability
+            order = np.argsort(abs(k))
+            cdf = np.cumsum(p_k[order]) / p_k.sum()
+            k_abs = abs(k[order])
+            k_lo = max(k_abs[np.searchsorted(cdf, 0.005)], self._dk(d))
+            k_hi = max(k_abs[min(np.searchsorted(cdf, 0.995),
+                                 len(k) - 1)], k_lo)
+
+            L = x[-1] - x[0]
+            w = min(2 * np.pi / k_lo, 0.25 * L) if width is None else width
+            if strength is None:
+                v_hi = self.hbar * k_hi / self.m
+                W0 = ((power + 1) * self.hbar * v_hi
+                      * np.log(1. / reflection) / (2 * w))
+            else:
+                W0 = strength
+
+            s = np.maximum(x[0] + w - x, 0) + np.maximum(x - x[-1] + w, 0)
+            shape = [1] * ndim
+            shape[d] = -1
+            self.absorber = (self.absorber
+                             + (W0 * (s / w) ** power).reshape(shape))
+        self.absorber = np.asarray(self.absorber, dtype=self.V_dtype)
+
+        # the evolution operators with the old potential no longer apply
+        self.V_id_ = next(_potential_ids)
+        self.dt_ = None
+
+    def _dk(self, d):
+        return self.dk[d] if isinstance(self.dk, list) else self.dk
 
     def time_step(self, dt, Nsteps = 1):
         """
         Perform a series of time-steps via the time-dependent
-        Schrodinger Equation.
+        Schrodinger Equation, using the split-operator integrator of
+        order self.order.  If the object holds an ensemble of wave
+        functions, all of them are advanced together.
 
         Parameters
         ----------
@@ -135,24 +584,488 @@ class Schrodinger(object):
         """
         self.dt = dt
 
+        # psi is transformed back and forth within a single buffer, so
+        # no arrays are allocated inside the loop
+        psi = self.psi_mod_x
+        fft = self.fft_engine.fft
+        ifft = self.fft_engine.ifft
+        axes = self.axes
+        t_start = self.t
+
+        k_ops = self.k_evolve_ops
+        n_sub = len(k_ops)
+        x_op = self._x_op
+
         if Nsteps > 0:
-            self.psi_mod_x *= self.x_evolve_half
+            psi *= x_op(0, t_start, 0)
 
-        for i in xrange(Nsteps - 1):
-            self.compute_k_from_x()
-            self.psi_mod_k *= self.k_evolve
-            self.compute_x_from_k()
-            self.psi_mod_x *= self.x_evolve
+        for i in range(Nsteps):
+            for j in range(n_sub):
+                fft(psi, axes)
+                psi *= k_ops[j]
+                ifft(psi, axes)
+
+                if j < n_sub - 1:
+                    psi *= x_op(j + 1, t_start, i)
+
+            self.step_count += 1
+            if i == Nsteps - 1:
+                psi *= x_op(-2, t_start, i)
+                break
+
+            due = self._monitors_due()
+            if not due:
+                # nothing needs psi between this step and the next, so
+                # the two half-steps in x are merged
+                psi *= x_op(-1, t_start, i)
+                continue
+
+            psi *= x_op(-2, t_start, i)
+            self.t = t_start + (i + 1) * dt
+            self.psi_mod_x = psi
+            for monitor in due:
+                monitor.record(self)
+            psi *= x_op(0, t_start, i + 1)
+
+        self.psi_mod_x = psi
+
+        self.t = t_start + dt * Nsteps
+
+        if Nsteps > 0:
+            for monitor in self._monitors_due():
+                monitor.record(self)
+
+    def add_monitor(self, monitor):
+        """
+        Add a monitor, such as a SnapshotRecorder.  monitor.record(self)
+        is called after every monitor.every time steps.
+        """
+        self.monitors.append(monitor)
+
+    def _monitors_due(self):
+        return [monitor for monitor in self.monitors
+                if self.step_count % monitor.every == 0]
+
+    def evolve(self, t_final, tol, dt=None, safety=0.9):
+        """
+        Evolve the wave function up to time t_final with an adaptive
+        time-step.
+
+        The error of each step is estimated by step doubling: the step is
+        taken once with dt and once as two steps of dt / 2, and dt is
+        adjusted so that the estimated error stays below the tolerance.
+        The more accurate, half-step result is kept.
+
+        Parameters
+        ----------
+        t_final : float
+            the time at which to stop
+        tol : float
+            tolerance on the estimated L2 error of psi_x per time step.
+            For an ensemble, the largest error of any member is used.
+        dt : float, optional
+            the initial trial time step.  If not specified, the last step
+            size proposed by a previous call is used, or else self.dt.
+        safety : float
+            safety factor applied to the proposed step size (default 0.9)
+
+        Returns
+        -------
+        Nsteps : int
+            the number of accepted steps
+        """
+        if dt is None:
+            dt = self.dt_adapt_ or self.dt_ or (t_final - self.t)
+
+        # monitors only see accepted steps
+        monitors = self.monitors
+        self.monitors = []
+        try:
+            return self._evolve(t_final, tol, dt, safety, monitors)
+        finally:
+            self.monitors = monitors
+
+    def _evolve(self, t_final, tol, dt, safety, monitors):
+
+        # buffers for the initial and the single-step states
+        psi_start = self.fft_engine.empty(self.shape, self.dtype)
+        psi_single = self.fft_engine.empty(self.shape, self.dtype)
+        norm = abs(self.x_phase.flat[0]) * np.sqrt(self.dV)
+
+        Nsteps = 0
+        while self.t < t_final:
+            last = (dt >= t_final - self.t)
+            step = (t_final - self.t) if last else dt
+
+            t_start = self.t
+            step_count = self.step_count
+            psi_start[...] = self.psi_mod_x
+
+            self.time_step(step, 1)
+            psi_single[...] = self.psi_mod_x
+
+            self.t = t_start
+            self.psi_mod_x = psi_start
+            self.time_step(0.5 * step, 2)
+
+            psi_single -= self.psi_mod_x
+            err = norm * np.sqrt((abs(psi_single) ** 2).sum(self.axes).max())
+            err /= (2 ** self.order - 1)
+
+            # propose the next step size, within a factor of five
+            if err == 0:
+                factor = 5.
+            else:
+                factor = safety * (tol / err) ** (1. / (self.order + 1))
+                factor = min(5., max(0.2, factor))
+
+            self.step_count = step_count
+            if err <= tol:
+                Nsteps += 1
+                self.step_count += 1
+                if last:
+                    self.t = t_final
+                for monitor in monitors:
+                    if self.step_count % monitor.every == 0:
+                        monitor.record(self)
+                if last:
+                    break
+                dt = step * factor
+            else:
+                self.t = t_start
+                self.psi_mod_x = psi_start
+                dt = step * factor
+
+        self.dt_adapt_ = dt
+        return Nsteps
+
+
+class SchrodingerND(Schrodinger):
+    """
+    Class which implements a numerical solution of the time-dependent
+    Schrodinger equation for an arbitrary potential on a 2- or
+    3-dimensional grid, using the same split-step scheme as Schrodinger.
+
+    By default the wave function and all evolution operators are stored
+    in single precision, and the cache of evolution operators is sized to
+    keep the total storage within a memory budget.
+    """
+    def __init__(self, x, psi_x0, V_x,
+                 k0=None, hbar=1, m=1, t0=0.0,
+                 fft_engine=None, workers=1, order=2, V_period=None,
+                 cache_size=None, dtype=np.complex64, max_memory=2 ** 30):
+        """
+        Parameters
+        ----------
+        x : sequence of array_like, float
+            one array of evenly spaced coordinates per dimension, of
+            lengths N1, N2 (, N3)
+        psi_x0 : array_like, complex
+            [N1 x N2 (x N3)] array of the initial wave function at time t0
+        V_x : array_like, float
+            [N1 x N2 (x N3)] array giving the potential at each grid point,
+            or a time-dependent potential as described in Schrodinger.  A
+            function is called as V(x, t) with the sequence x.
+        k0 : sequence of float, optional
+            the minimum value of k along each dimension; see Schrodinger.
+            If not specified, the range along each dimension is [-k0, k0]
+        hbar, m, t0, fft_engine, workers, order, V_period :
+            see Schrodinger
+        cache_size : int, optional
+            the maximum number of evolution operators kept for reuse.
+            By default, and at most, as many as fit in max_memory.
+        dtype : complex dtype
+            the type used to store psi and the evolution operators
+            (default = complex64)
+        max_memory : int
+            the number of bytes which psi, the potential and the cached
+            evolution operators may use together (default = 1 GB).  A
+            2048 x 2048 grid in single precision needs about 400 MB.
+        """
+        # Validation of array inputs
+        self.dtype = np.dtype(dtype)
+        self.x = [np.asarray(xi, dtype=float) for xi in x]
+        self.shape = tuple(xi.size for xi in self.x)
+        psi_x0 = np.asarray(psi_x0)
+        self.t = t0
+        self.V_dtype = np.finfo(self.dtype).dtype
+        self.V_period = V_period
+        self.V_x = V_x
+        assert len(self.shape) in (2, 3)
+        assert all(xi.ndim == 1 for xi in self.x)
+        assert psi_x0.shape == self.shape
+        assert self.V_x.shape == self.shape
+        self._check_order(order)
+        self._set_memory_budget(max_memory, order)
+
+        # Set internal parameters
+        self.ndim = len(self.shape)
+        self.axes = tuple(range(-self.ndim, 0))
+        self.N = self.shape
+        self.dx = [xi[1] - xi[0] for xi in self.x]
+        self.dV = np.prod(self.dx)
+        self.dk = [2 * np.pi / (N * dx) for N, dx in zip(self.N, self.dx)]
+
+        # set momentum scale
+        if k0 is None:
+            k0 = self.ndim * [None]
+        self.k0 = [-0.5 * N * dk if k0i is None else k0i
+                   for k0i, N, dk in zip(k0, self.N, self.dk)]
+        self.k = [k0i + dk * np.arange(N)
+                  for k0i, dk, N in zip(self.k0, self.dk, self.N)]
+
+        # the phase factors are separable, and are built from one
+        # vector per dimension
+        self.x_phase = self._outer([np.exp(1j * k[0] * x)
+                                    * np.sqrt(2 * np.pi) / dx
+                                    for x, k, dx in zip(self.x, self.k,
+                                                        self.dx)])
+        self.k_phase = self._outer([np.exp(-1j * x[0] * dk * np.arange(N))
+                                    for x, dk, N in zip(self.x, self.dk,
+                                                        self.N)])
+
+        self._init_state(psi_x0, hbar, m, fft_engine, workers, order,
+                         cache_size)
+
+    def _outer(self, factors):
+        """the outer product of one vector per dimension"""
+        out = np.ones(self.shape, dtype=self.dtype)
+        for axis, f in enumerate(factors):
+            shape = [1] * self.ndim
+            shape[axis] = -1
+            out *= f.reshape(shape).astype(self.dtype)
+        return out
 
-        self.compute_k_from_x()
-        self.psi_mod_k *= self.k_evolve
+    def _set_memory_budget(self, max_memory, order):
+        n_ops = self._cache_budget(max_memory)
+        n_required = 2 * len(SPLITTING_WEIGHTS[order]) + 2
+        if n_ops < n_required:
+            grid_bytes = self.dtype.itemsize * np.prod(self.shape)
+            raise MemoryError("a grid of shape %s at order %i needs at "
+                              "least %i MB"
+                              % (self.shape, order,
+                                 (n_required + self.n_fixed_grids)
+                                 * grid_bytes / 2 ** 20))
+        self.evolve_cache_size = self.max_cache_ops_ = n_ops
 
-        self.compute_x_from_k()
-        self.psi_mod_x *= self.x_evolve_half
+    def _resize_cache(self):
+        # the operators may never outgrow the memory budget
+        Schrodinger._resize_cache(self)
+        self.evolve_cache_size = min(self.evolve_cache_size,
+                                     self.default_cache_size_)
 
-        self.compute_k_from_x()
+    def _k_evolve(self, tau):
+        # k^2 is a sum over dimensions, so the kinetic operator is the
+        # outer product of one exponential per dimension
+        return self._cached_evolve(
+            ('k', tau), lambda: self._outer([np.exp(-0.5 * 1j * self.hbar
+                                                    / self.m * (k * k) * tau)
+                                             for k in self.k]))
 
-        self.t += dt * Nsteps
+
+class SnapshotRecorder(object):
+    """
+    Record snapshots of a Schrodinger run to disk while it runs.
+
+    Add the recorder with Schrodinger.add_monitor().  Every `every` time
+    steps, the chosen quantity is downcast, decimated in space and
+    appended to filename + '.npy', and the time to filename + '_t.npy'.
+    Call close() when done; load_snapshots() then memory-maps the result.
+    """
+    quantities = ('abs_x', 'abs_k', 'psi_x', 'psi_k')
+
+    def __init__(self, filename, every=1, quantity='abs_x', dtype=None,
+                 decimate=1, chunk_size=64):
+        """
+        Parameters
+        ----------
+        filename : string
+            base name of the output files
+        every : int
+            number of time steps between snapshots (default = 1)
+        quantity : string
+            'abs_x' or 'abs_k' for |psi_x| or |psi_k|, or 'psi_x' or
+            'psi_k' for the full complex wave function (default 'abs_x')
+        dtype : dtype, optional
+            the type to store snapshots in, e.g. np.float32 or
+            np.complex64 to halve the storage.  If not specified, the
+            type of the wave function is used.
+        decimate : int
+            keep only every decimate-th grid point along each spatial
+            dimension (default = 1)
+        chunk_size : int
+            number of snapshots held in memory between writes
+        """
+        if quantity not in self.quantities:
+            raise ValueError("quantity must be one of %s"
+                             % (self.quantities,))
+        self.filename = filename
+        self.every = every
+        self.quantity = quantity
+        self.dtype = dtype
+        self.decimate = decimate
+        self.chunk_size = chunk_size
+        self.data_writer = None
+        self.t_writer = None
+
+    def record(self, S):
+        """append a snapshot of the Schrodinger object S"""
+        index = ((Ellipsis,)
+                 + len(S.axes) * (slice(None, None, self.decimate),))
+        if self.quantity.endswith('x'):
+            frame = S.psi_mod_x[index] * S.x_phase[index]
+        else:
+            frame = S.psi_mod_k[index] * S.k_phase[index]
+        if self.quantity.startswith('abs'):
+            frame = abs(frame)
+
+        if self.data_writer is None:
+            dtype = frame.dtype if self.dtype is None else self.dtype
+            self.data_writer = NpyStreamWriter(self.filename + '.npy',
+                                               frame.shape, dtype,
+                                               self.chunk_size)
+            self.t_writer = NpyStreamWriter(self.filename + '_t.npy',
+                                            (), float, self.chunk_size)
+        self.data_writer.append(frame)
+        self.t_writer.append(S.t)
+
+    def close(self):
+        if self.data_writer is not None:
+            self.data_writer.close()
+            self.t_writer.close()
+
+
+class Observables(object):
+    """
+    Record expectation values of a Schrodinger run while it runs.
+
+    Add the object with Schrodinger.add_monitor().  Every `every` time
+    steps it appends, for each wave function of the ensemble:
+
+      t            : the time
+      norm         : the norm of psi
+      x_mean       : <x>
+      p_mean       : <p>
+      energy       : <H> = <p^2> / 2m + <V>, with V at the time t
+      transmission : the probability of finding the particle beyond
+                     x_transmission (NaN if x_transmission is not given)
+
+    The expectation values are normalized by the norm.  On an N-D grid,
+    x_mean and p_mean have one entry per dimension along their last axis,
+    and the transmission is measured along the first dimension.
+
+    The reductions are computed directly from psi_mod_x and psi_mod_k,
+    into arrays which are preallocated and grown by doubling.  <p> and
+    the energy need psi in k-space, which costs one FFT per record.
+    """
+    names = ('t', 'norm', 'x_mean', 'p_mean', 'energy', 'transmission')
+
+    def __init__(self, every=1, x_transmission=None, size=1024):
+        self.every = every
+        self.x_transmission = x_transmission
+        self.size = size
+        self.n = 0
+        self.arrays = None
+
+    def _allocate(self, S):
+        ndim = len(S.axes)
+        ens_shape = S.shape[:len(S.shape) - ndim]
+        vec_shape = ens_shape + ((ndim,) if ndim > 1 else ())
+        shapes = dict(t=(), norm=ens_shape, x_mean=vec_shape,
+                      p_mean=vec_shape, energy=ens_shape,
+                      transmission=ens_shape)
+        self.arrays = dict((name, np.zeros((self.size,) + shapes[name]))
+                           for name in self.names)
+
+    def _grow(self):
+        for name in self.names:
+            a = self.arrays[name]
+            self.arrays[name] = np.concatenate([a, np.zeros_like(a)])
+
+    def _marginals(self, density, axes):
+        """sum a density over all but one spatial axis, for each axis"""
+        return [density.sum(axis=tuple(b for b in axes if b != a))
+                if len(axes) > 1 else density for a in axes]
+
+    def record(self, S):
+        if self.arrays is None:
+            self._allocate(S)
+        if self.n == len(self.arrays['t']):
+            self._grow()
+
+        xs = S.x if isinstance(S.x, list) else [S.x]
+        ks = S.k if isinstance(S.k, list) else [S.k]
+
+        # |psi_x|^2 differs from |psi_mod_x|^2 by a constant factor, and
+        # |psi_k|^2 equals |psi_mod_k|^2
+        density = abs(S.psi_mod_x) ** 2
+        total = density.sum(axis=S.axes)
+        marginals = self._marginals(density, S.axes)
+        x_mean = [np.dot(m, x) / total for m, x in zip(marginals, xs)]
+        V_mean = (density * S.potential_at(S.t)).sum(axis=S.axes) / total
+
+        density_k = abs(S.psi_mod_k) ** 2
+        total_k = density_k.sum(axis=S.axes)
+        marginals_k = self._marginals(density_k, S.axes)
+        k_mean = [np.dot(m, k) / total_k for m, k in zip(marginals_k, ks)]
+        k2_mean = sum(np.dot(m, k * k) / total_k
+                      for m, k in zip(marginals_k, ks))
+
+        i = self.n
+        a = self.arrays
+        a['t'][i] = S.t
+        a['norm'][i] = total * abs(S.x_phase.flat[0]) ** 2 * S.dV
+        if len(xs) > 1:
+            a['x_mean'][i] = np.stack(x_mean, -1)
+            a['p_mean'][i] = S.hbar * np.stack(k_mean, -1)
+        else:
+            a['x_mean'][i] = x_mean[0]
+            a['p_mean'][i] = S.hbar * k_mean[0]
+        a['energy'][i] = 0.5 * S.hbar ** 2 / S.m * k2_mean + V_mean
+        if self.x_transmission is None:
+            a['transmission'][i] = np.nan
+        else:
+            beyond = (xs[0] > self.x_transmission)
+            a['transmission'][i] = marginals[0][..., beyond].sum(-1) / total
+        self.n += 1
+
+    def _get(self, name):
+        if self.arrays is None:
+            return np.zeros(0)
+        return self.arrays[name][:self.n]
+
+    t = property(lambda self: self._get('t'))
+    norm = property(lambda self: self._get('norm'))
+    x_mean = property(lambda self: self._get('x_mean'))
+    p_mean = property(lambda self: self._get('p_mean'))
+    energy = property(lambda self: self._get('energy'))
+    transmission = property(lambda self: self._get('transmission'))
+
+
+def load_snapshots(filename):
+    """
+    Memory-map the snapshots written by a SnapshotRecorder.
+
+    Returns
+    -------
+    t : ndarray
+        the time of each snapshot
+    data : memory-mapped ndarray
+        the snapshots, with time along the first axis
+    """
+    return (np.load(filename + '_t.npy'),
+            np.load(filename + '.npy', mmap_mode='r'))
+
+
+# source of the ids which tell apart potentials in the operator caches
+_potential_ids = count()
+
+
+def _is_schedule(V_x):
+    """check whether V_x is a list of (t, V) pairs"""
+    return (isinstance(V_x, (list, tuple)) and len(V_x) > 0
+            and all(isinstance(item, tuple) and len(item) == 2
+                    and np.ndim(item[1]) > 0 for item in V_x))
 
 
 ######################################################################
@@ -192,118 +1105,120 @@ def square_barrier(x, width, height):
 ######################################################################
 # Create the animation
 
-# specify time steps and duration
-dt = 0.01
-N_steps = 50
-t_max = 120
-frames = int(t_max / float(N_steps * dt))
-
-# specify constants
-hbar = 1.0   # planck's constant
-m = 1.9      # particle mass
-
-# specify range in x coordinate
-N = 2 ** 11
-dx = 0.1
-x = dx * (np.arange(N) - 0.5 * N)
-
-# specify potential
-V0 = 1.5
-L = hbar / np.sqrt(2 * m * V0)
-a = 3 * L
-x0 = -60 * L
-V_x = square_barrier(x, a, V0)
-V_x[x < -98] = 1E6
-V_x[x > 98] = 1E6
-
-# specify initial momentum and quantities derived from it
-p0 = np.sqrt(2 * m * 0.2 * V0)
-dp2 = p0 * p0 * 1./80
-d = hbar / np.sqrt(2 * dp2)
-
-k0 = p0 / hbar
-v0 = p0 / m
-psi_x0 = gauss_x(x, d, x0, k0)
-
-# define the Schrodinger object which performs the calculations
-S = Schrodinger(x=x,
-                psi_x0=psi_x0,
-                V_x=V_x,
-                hbar=hbar,
-                m=m,
-                k0=-28)
+if __name__ == '__main__':
 
-######################################################################
-# Set up plot
-fig = pl.figure()
-
-# plotting limits
-xlim = (-100, 100)
-klim = (-5, 5)
-
-# top axes show the x-space data
-ymin = 0
-ymax = V0
-ax1 = fig.add_subplot(211, xlim=xlim,
-                      ylim=(ymin - 0.2 * (ymax - ymin),
-                            ymax + 0.2 * (ymax - ymin)))
-psi_x_line, = ax1.plot([], [], c='r', label=r'$|\psi(x)|$')
-V_x_line, = ax1.plot([], [], c='k', label=r'$V(x)$')
-center_line = ax1.axvline(0, c='k', ls=':',
-                          label = r"$x_0 + v_0t$")
-
-title = ax1.set_title("")
-ax1.legend(prop=dict(size=12))
-ax1.set_xlabel('$x$')
-ax1.set_ylabel(r'$|\psi(x)|$')
-
-# bottom axes show the k-space data
-ymin = abs(S.psi_k).min()
-ymax = abs(S.psi_k).max()
-ax2 = fig.add_subplot(212, xlim=klim,
-                      ylim=(ymin - 0.2 * (ymax - ymin),
-                            ymax + 0.2 * (ymax - ymin)))
-psi_k_line, = ax2.plot([], [], c='r', label=r'$|\psi(k)|$')
-
-p0_line1 = ax2.axvline(-p0 / hbar, c='k', ls=':', label=r'$\pm p_0$')
-p0_line2 = ax2.axvline(p0 / hbar, c='k', ls=':')
-mV_line = ax2.axvline(np.sqrt(2 * V0) / hbar, c='k', ls='--',
-                      label=r'$\sqrt{2mV_0}$')
-ax2.legend(prop=dict(size=12))
-ax2.set_xlabel('$k$')
-ax2.set_ylabel(r'$|\psi(k)|$')
-
-V_x_line.set_data(S.x, S.V_x)
+    # specify time steps and duration
+    dt = 0.01
+    N_steps = 50
+    t_max = 120
+    frames = int(t_max / float(N_steps * dt))
+
+    # specify constants
+    hbar = 1.0   # planck's constant
+    m = 1.9      # particle mass
+
+    # specify range in x coordinate
+    N = 2 ** 11
+    dx = 0.1
+    x = dx * (np.arange(N) - 0.5 * N)
+
+    # specify potential
+    V0 = 1.5
+    L = hbar / np.sqrt(2 * m * V0)
+    a = 3 * L
+    x0 = -60 * L
+    V_x = square_barrier(x, a, V0)
+    V_x[x < -98] = 1E6
+    V_x[x > 98] = 1E6
+
+    # specify initial momentum and quantities derived from it
+    p0 = np.sqrt(2 * m * 0.2 * V0)
+    dp2 = p0 * p0 * 1./80
+    d = hbar / np.sqrt(2 * dp2)
+
+    k0 = p0 / hbar
+    v0 = p0 / m
+    psi_x0 = gauss_x(x, d, x0, k0)
+
+    # define the Schrodinger object which performs the calculations
+    S = Schrodinger(x=x,
+                    psi_x0=psi_x0,
+                    V_x=V_x,
+                    hbar=hbar,
+                    m=m,
+                    k0=-28)
+
+    ######################################################################
+    # Set up plot
+    fig = pl.figure()
+
+    # plotting limits
+    xlim = (-100, 100)
+    klim = (-5, 5)
+
+    # top axes show the x-space data
+    ymin = 0
+    ymax = V0
+    ax1 = fig.add_subplot(211, xlim=xlim,
+                          ylim=(ymin - 0.2 * (ymax - ymin),
+                                ymax + 0.2 * (ymax - ymin)))
+    psi_x_line, = ax1.plot([], [], c='r', label=r'$|\psi(x)|$')
+    V_x_line, = ax1.plot([], [], c='k', label=r'$V(x)$')
+    center_line = ax1.axvline(0, c='k', ls=':',
+                              label = r"$x_0 + v_0t$")
+
+    title = ax1.set_title("")
+    ax1.legend(prop=dict(size=12))
+    ax1.set_xlabel('$x$')
+    ax1.set_ylabel(r'$|\psi(x)|$')
+
+    # bottom axes show the k-space data
+    ymin = abs(S.psi_k).min()
+    ymax = abs(S.psi_k).max()
+    ax2 = fig.add_subplot(212, xlim=klim,
+                          ylim=(ymin - 0.2 * (ymax - ymin),
+                                ymax + 0.2 * (ymax - ymin)))
+    psi_k_line, = ax2.plot([], [], c='r', label=r'$|\psi(k)|$')
+
+    p0_line1 = ax2.axvline(-p0 / hbar, c='k', ls=':', label=r'$\pm p_0$')
+    p0_line2 = ax2.axvline(p0 / hbar, c='k', ls=':')
+    mV_line = ax2.axvline(np.sqrt(2 * V0) / hbar, c='k', ls='--',
+                          label=r'$\sqrt{2mV_0}$')
+    ax2.legend(prop=dict(size=12))
+    ax2.set_xlabel('$k$')
+    ax2.set_ylabel(r'$|\psi(k)|$')
 
-######################################################################
-# Animate plot
-def init():
-    psi_x_line.set_data([], [])
-    V_x_line.set_data([], [])
-    center_line.set_data([], [])
-
-    psi_k_line.set_data([], [])
-    title.set_text("")
-    return (psi_x_line, V_x_line, center_line, psi_k_line, title)
-
-def animate(i):
-    S.time_step(dt, N_steps)
-    psi_x_line.set_data(S.x, 4 * abs(S.psi_x))
     V_x_line.set_data(S.x, S.V_x)
-    center_line.set_data(2 * [x0 + S.t * p0 / m], [0, 1])
 
-    psi_k_line.set_data(S.k, abs(S.psi_k))
-    title.set_text("t = %.2f" % S.t)
-    return (psi_x_line, V_x_line, center_line, psi_k_line, title)
+    ######################################################################
+    # Animate plot
+    def init():
+        psi_x_line.set_data([], [])
+        V_x_line.set_data([], [])
+        center_line.set_data([], [])
+
+        psi_k_line.set_data([], [])
+        title.set_text("")
+        return (psi_x_line, V_x_line, center_line, psi_k_line, title)
+
+    def animate(i):
+        S.time_step(dt, N_steps)
+        psi_x_line.set_data(S.x, 4 * abs(S.psi_x))
+        V_x_line.set_data(S.x, S.V_x)
+        center_line.set_data(2 * [x0 + S.t * p0 / m], [0, 1])
+
+        psi_k_line.set_data(S.k, abs(S.psi_k))
+        title.set_text("t = %.2f" % S.t)
+        return (psi_x_line, V_x_line, center_line, psi_k_line, title)
 
-# call the animator.  blit=True means only re-draw the parts that have changed.
-anim = animation.FuncAnimation(fig, animate, init_func=init,
-                               frames=frames, interval=30, blit=True)
+    # call the animator.  blit=True means only re-draw the parts that have changed.
+    anim = animation.FuncAnimation(fig, animate, init_func=init,
+                                   frames=frames, interval=30, blit=True)
 
 
-# uncomment the following line to save the video in mp4 format.  This
-# requires either mencoder or ffmpeg to be installed on your system
+    # uncomment the following line to save the video in mp4 format.  This
+    # requires either mencoder or ffmpeg to be installed on your system
 
-#anim.save('schrodinger_barrier.mp4', fps=15, extra_args=['-vcodec', 'libx264'])
+    #anim.save('schrodinger_barrier.mp4', fps=15, extra_args=['-vcodec', 'libx264'])
 
-pl.show()
+    pl.show()